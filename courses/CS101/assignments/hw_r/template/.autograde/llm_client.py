@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+LLM API 客户端
+
+OpenAI 兼容的 chat/completions 接口：共享连接池并发调用、按每分钟请求数（RPM）
+和每分钟 token 数（TPM）的令牌桶限速、429/5xx 时带抖动的指数退避重试（遵循 Retry-After）
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# 估算时为模型输出预留的 token 数
+COMPLETION_TOKENS_ESTIMATE = 300
+
+
+def estimate_tokens(text):
+    """
+    粗略估算文本的 token 数（不依赖分词器）
+
+    ASCII 字符约 4 个一个 token，中文等非 ASCII 字符约 1 个一个 token
+    """
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def parse_retry_after(value):
+    """解析 Retry-After（秒数或 HTTP 日期），返回秒数；无法解析时返回 None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    令牌桶限速（线程安全）
+
+    capacity 为每分钟可用的令牌数，按速率连续补充；0 或 None 表示不限速
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = float(capacity or 0)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """取出 amount 个令牌，不足时阻塞等待（超过桶容量的请求按容量计）"""
+        if not self.capacity:
+            return
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait_time = (amount - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class LLMClient:
+    """
+    LLM API 客户端（线程安全，可在多个线程中共享）
+
+    Parameters
+    ----------
+    url : str
+        API 地址（chat/completions）
+    key : str
+        API 密钥
+    model : str
+        模型名称
+    rpm : int, optional
+        每分钟最多请求数（默认读取 LLM_RPM，0 表示不限速）
+    tpm : int, optional
+        每分钟最多 token 数（默认读取 LLM_TPM，按估算的提示词 token 数计）
+    max_retries : int, optional
+        429/5xx、超时或连接错误时的最大重试次数（默认读取 LLM_MAX_RETRIES，默认 5）
+    backoff : float
+        指数退避的基础秒数
+    timeout : tuple
+        (连接超时, 读取超时) 秒
+    pool_size : int
+        连接池大小
+    """
+
+    def __init__(self, url, key, model, rpm=None, tpm=None, max_retries=None, backoff=1.0,
+                 timeout=(10, 60), pool_size=8):
+        self.url = url
+        self.model = model
+        self.backoff = backoff
+        self.timeout = timeout
+        if rpm is None:
+            rpm = int(os.getenv("LLM_RPM", "0") or 0)
+        if tpm is None:
+            tpm = int(os.getenv("LLM_TPM", "0") or 0)
+        if max_retries is None:
+            max_retries = int(os.getenv("LLM_MAX_RETRIES", "5") or 0)
+        self.max_retries = max_retries
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+        self.pool_size = max(1, pool_size)
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {key}",
+            "Content-Type": "application/json"
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.lock = threading.Lock()
+        self.usage = {"requests": 0, "retries": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def _record_usage(self, usage, retries):
+        with self.lock:
+            self.usage["requests"] += 1
+            self.usage["retries"] += retries
+            for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                self.usage[key] += int(usage.get(key, 0) or 0)
+
+    def chat_json(self, prompt):
+        """
+        发送提示词并把返回内容解析为 JSON
+
+        返回 (结果 dict, usage dict)；重试用尽后抛出最后一次的异常
+        （requests 异常或 json.JSONDecodeError）
+        """
+        data = {
+            "model": self.model,
+            "temperature": 0,
+            "top_p": 1,
+            "messages": [{"role": "user", "content": prompt}],
+            "response_format": {"type": "json_object"}
+        }
+        estimated = estimate_tokens(prompt) + COMPLETION_TOKENS_ESTIMATE
+
+        for attempt in range(self.max_retries + 1):
+            self.request_bucket.acquire(1)
+            self.token_bucket.acquire(estimated)
+            retry_after = None
+            try:
+                response = self.session.post(self.url, json=data, timeout=self.timeout)
+                if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    print(f"LLM API returned {response.status_code}, retrying "
+                          f"({attempt + 1}/{self.max_retries})", file=sys.stderr)
+                else:
+                    response.raise_for_status()
+                    result = response.json()
+                    content = result.get("choices", [{}])[0].get("message", {}).get("content", "{}")
+                    usage = result.get("usage") or {}
+                    self._record_usage(usage, attempt)
+                    return json.loads(content), usage
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"LLM API request failed: {e}, retrying ({attempt + 1}/{self.max_retries})", file=sys.stderr)
+
+            delay = self.backoff * (2 ** attempt) + random.uniform(0, self.backoff)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            time.sleep(delay)
@@ -6,12 +6,16 @@ LLM 简答题评分脚本
 """
 
 import os
+import re
 import json
+import hashlib
 import argparse
 import requests
 import sys
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from llm_client import LLMClient, estimate_tokens
 
 # 加载环境变量（支持从 .env 文件或环境变量读取）
 load_dotenv()
@@ -24,6 +28,24 @@ def read_file(path):
     return ""
 
 
+# 修改 PROMPT_TEMPLATE / BATCH_PROMPT_TEMPLATE 或提示词中答案、量表的处理方式时递增，使旧的评分缓存失效
+PROMPT_VERSION = "2"
+
+# 每个答案放入提示词的 token 上限（估算值），超出时保留开头和结尾；0 表示不限制
+DEFAULT_MAX_ANSWER_TOKENS = int(os.getenv("LLM_MAX_ANSWER_TOKENS", "2000") or 0)
+
+# 作答模板中的占位行，例如 "请在此处填写你的答案。"、"（此处填写各自适合的使用场景）"
+PLACEHOLDER_RE = re.compile(
+    r"^(?:[（(]\s*请?\s*(?:在此处|此处|在此)(?:填写|作答|输入)[^）)]*[）)]"
+    r"|请?(?:在此处|此处|在此)(?:填写|作答|输入)(?:你的)?答案[。.]?)$"
+)
+
+# 作答模板目录：sync_autograde.py / generate_repos.py 把作业模板中的 answers/saN.md 复制到这里
+DEFAULT_TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "answer_templates")
+
+# 量表中只在本地使用（送审、汇总）的字段，不放入提示词
+LOCAL_RUBRIC_FIELDS = {"version", "max_score", "borderline_band"}
+
 PROMPT_TEMPLATE = """你是严格且一致的助教，按提供的评分量表为学生的简答题评分。
 
 - 只依据量表，不做主观延伸；允许多样表述。
@@ -51,7 +73,148 @@ PROMPT_TEMPLATE = """你是严格且一致的助教，按提供的评分量表
 """
 
 
-def call_llm(url, key, model, prompt):
+BATCH_PROMPT_TEMPLATE = """你是严格且一致的助教，按提供的评分量表为学生的多道简答题逐题评分。
+
+- 每道题独立评分，只依据量表，不做主观延伸；允许多样表述。
+- 不输出任何解释性文本；只输出 JSON，包含:
+  {{
+    "results": [
+      {{
+        "id": "题目编号，如 sa1",
+        "total": number(0-10, 两位小数),
+        "criteria": [
+          {{"id":"accuracy","score":0-3,"reason":"要点式一句话"}},
+          {{"id":"coverage","score":0-3,"reason":""}},
+          {{"id":"clarity","score":0-3,"reason":""}}
+        ],
+        "flags": [],
+        "confidence": number(0-1)
+      }}
+    ]
+  }}
+每道题在 results 中输出一项。如果某题答案与题目无关，该题 total=0，并加 flag "need_review"。
+
+【评分量表】
+<<<{rubric}>>>
+
+{items}
+"""
+
+BATCH_ITEM_TEMPLATE = """【题目 {id}】
+<<<{question}>>>
+
+【学生答案 {id}】
+<<<{answer}>>>
+"""
+
+
+def compress_answer(answer, template=None):
+    """
+    去掉答案中不影响评分的内容：HTML 注释、作答模板的占位行、行尾空白、
+    多余的空行，以及连续重复的行（例如粘贴的大段程序输出）
+
+    提供 template（模板中的 answers/saN.md）时，同时去掉与模板中非标题行相同的行；
+    去掉这些内容后只剩与模板完全相同的标题时视为未作答，返回空字符串。
+    学生可能把答案写在标题行上，因此不提供模板时不按标题判断是否作答
+    """
+    answer = re.sub(r"<!--.*?-->", "", answer, flags=re.DOTALL)
+    template_lines, template_headings = set(), set()
+    for line in (template or "").splitlines():
+        line = line.strip()
+        if line.startswith("#"):
+            template_headings.add(line)
+        elif line:
+            template_lines.add(line)
+    lines = []
+    repeat = 0
+    for line in answer.splitlines():
+        line = line.rstrip()
+        if PLACEHOLDER_RE.match(line.strip()) or line.strip() in template_lines:
+            continue
+        if lines and line and line == lines[-1]:
+            repeat += 1
+            continue
+        if repeat:
+            lines.append(f"……（上一行重复 {repeat} 次）")
+            repeat = 0
+        lines.append(line)
+    if repeat:
+        lines.append(f"……（上一行重复 {repeat} 次）")
+    if all(not line.strip() or line.strip() in template_headings for line in lines):
+        return ""
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def truncate_answer(answer, max_tokens):
+    """
+    把答案截断到约 max_tokens 个 token：保留开头约 2/3 和结尾约 1/3，尽量在行边界处截断
+
+    返回 (答案, 是否截断)
+    """
+    if not max_tokens or estimate_tokens(answer) <= max_tokens:
+        return answer, False
+
+    def char_tokens(ch):
+        return 0.25 if ord(ch) < 128 else 1.0
+
+    head_budget = max_tokens * 2 / 3
+    tail_budget = max_tokens - head_budget
+    head_end, used = 0, 0.0
+    while head_end < len(answer) and used + char_tokens(answer[head_end]) <= head_budget:
+        used += char_tokens(answer[head_end])
+        head_end += 1
+    tail_start, used = len(answer), 0.0
+    while tail_start > head_end and used + char_tokens(answer[tail_start - 1]) <= tail_budget:
+        used += char_tokens(answer[tail_start - 1])
+        tail_start -= 1
+
+    cut = answer.rfind("\n", 0, head_end)
+    if cut > head_end // 2:
+        head_end = cut
+    cut = answer.find("\n", tail_start)
+    if 0 <= cut < (tail_start + len(answer)) // 2:
+        tail_start = cut + 1
+
+    omitted = estimate_tokens(answer[head_end:tail_start])
+    truncated = f"{answer[:head_end].rstrip()}\n\n……（中间省略约 {omitted} tokens）……\n\n{answer[tail_start:].lstrip()}"
+    return truncated, True
+
+
+def prepare_answer(answer, max_tokens=DEFAULT_MAX_ANSWER_TOKENS, template=None):
+    """放入提示词前压缩并截断答案，返回 (答案, 是否截断)"""
+    return truncate_answer(compress_answer(answer, template), max_tokens)
+
+
+def load_answer_template(templates_dir, question_id):
+    """读取题目的作答模板 {templates_dir}/{question_id}.md，不存在时返回 None"""
+    if not templates_dir or not question_id:
+        return None
+    return read_file(os.path.join(templates_dir, f"{question_id}.md")) or None
+
+
+def prompt_rubric(rubric_text, question_ids=None):
+    """
+    提示词中使用的量表：去掉只在本地使用的字段，按题目编号（sa1 对应 SA1）
+    只保留相关题目，并输出为紧凑的 JSON。不是 JSON 时原样返回
+    """
+    try:
+        rubric_data = json.loads(rubric_text)
+    except ValueError:
+        return rubric_text
+    if not isinstance(rubric_data, dict):
+        return json.dumps(rubric_data, ensure_ascii=False, separators=(",", ":"))
+    
+    rubric_data = {k: v for k, v in rubric_data.items() if k not in LOCAL_RUBRIC_FIELDS}
+    questions = rubric_data.get("questions")
+    if question_ids and isinstance(questions, list):
+        wanted = {str(q).lower() for q in question_ids}
+        matched = [q for q in questions if isinstance(q, dict) and str(q.get("id", "")).lower() in wanted]
+        if matched:
+            rubric_data["questions"] = matched
+    return json.dumps(rubric_data, ensure_ascii=False, separators=(",", ":"))
+
+
+def call_llm(url, key, model, prompt, client=None, with_usage=False):
     """
     调用 LLM API
     
@@ -65,42 +228,29 @@ def call_llm(url, key, model, prompt):
         模型名称
     prompt : str
         提示词
+    client : LLMClient, optional
+        共享的 LLM 客户端（批量评分时复用连接和限速）；不提供时临时创建
+    with_usage : bool
+        为 True 时同时返回 API 报告的 token 用量
     
     Returns
     -------
     dict
-        LLM 返回的 JSON 结果
+        LLM 返回的 JSON 结果；with_usage=True 时为 (结果, usage dict)
     """
-    headers = {
-        "Authorization": f"Bearer {key}",
-        "Content-Type": "application/json"
-    }
-    
-    data = {
-        "model": model,
-        "temperature": 0,
-        "top_p": 1,
-        "messages": [{"role": "user", "content": prompt}],
-        "response_format": {"type": "json_object"}
-    }
+    own_client = client is None
+    if own_client:
+        client = LLMClient(url, key, model)
     
     try:
-        # 设置超时：连接超时 10 秒，读取超时 60 秒
-        response = requests.post(
-            url, 
-            headers=headers, 
-            json=data, 
-            timeout=(10, 60)
-        )
-        response.raise_for_status()
-        result = response.json()
-        content = result.get("choices", [{}])[0].get("message", {}).get("content", "{}")
-        return json.loads(content)
+        # 429/5xx、超时和连接错误由 LLMClient 退避重试
+        result, usage = client.chat_json(prompt)
+        return (result, usage) if with_usage else result
     except requests.exceptions.Timeout as e:
         print(f"LLM API request timeout: {e}", file=sys.stderr)
         raise
     except requests.exceptions.HTTPError as e:
-        print(f"LLM API HTTP error: {e} (status: {response.status_code})", file=sys.stderr)
+        print(f"LLM API HTTP error: {e} (status: {e.response.status_code})", file=sys.stderr)
         raise
     except requests.exceptions.RequestException as e:
         print(f"LLM API request failed: {e}", file=sys.stderr)
@@ -108,55 +258,80 @@ def call_llm(url, key, model, prompt):
     except json.JSONDecodeError as e:
         print(f"Failed to parse LLM response as JSON: {e}", file=sys.stderr)
         raise
+    finally:
+        if own_client:
+            client.close()
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Grade short answer questions using LLM")
-    parser.add_argument("--question", required=True, help="Path to question file")
-    parser.add_argument("--answer", required=True, help="Path to answer file")
-    parser.add_argument("--rubric", required=True, help="Path to rubric JSON file")
-    parser.add_argument("--out", default="grade.json", help="Output JSON file")
-    parser.add_argument("--summary", default="summary.md", help="Output summary markdown file")
-    parser.add_argument("--model", default=os.getenv("LLM_MODEL", "deepseek-chat"))
-    parser.add_argument("--api_url", default=os.getenv("LLM_API_URL", "https://api.deepseek.com/chat/completions"))
-    parser.add_argument("--api_key", default=os.getenv("LLM_API_KEY", ""))
-    args = parser.parse_args()
-    
-    # 验证必需的配置
-    if not args.api_key:
-        print("Warning: LLM_API_KEY not set. LLM grading may fail.", file=sys.stderr)
-    
-    # 读取文件
-    question = read_file(args.question).strip()
-    answer = read_file(args.answer).strip()
-    rubric_text = read_file(args.rubric).strip()
-    
-    if not question or not answer:
-        print(f"Warning: Empty question or answer file", file=sys.stderr)
-        resp = {
-            "total": 0,
-            "criteria": [],
-            "flags": ["need_review", "empty_answer"],
-            "confidence": 0.0
-        }
-    else:
-        # 调用 LLM
-        try:
-            prompt = PROMPT_TEMPLATE.format(
-                question=question,
-                rubric=rubric_text,
-                answer=answer
-            )
-            resp = call_llm(args.api_url, args.api_key, args.model, prompt)
-        except Exception as e:
-            print(f"LLM grading failed: {e}", file=sys.stderr)
-            resp = {
-                "total": 0,
-                "criteria": [],
-                "flags": ["need_review", "llm_error"],
-                "confidence": 0.0
-            }
+def cache_key(question, rubric_text, answer, model, template="question"):
+    """
+    评分缓存键：题目、量表、答案、模型、提示词模板和版本的 SHA-256
+
+    template 为 "question"（PROMPT_TEMPLATE，逐题评分）或 "batch"（BATCH_PROMPT_TEMPLATE，
+    一次调用评分多题），两种提示词的评分结果互不复用
+    """
+    payload = json.dumps([question, rubric_text, answer, model, template, PROMPT_VERSION], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_valid_grade(resp):
+    """
+    检查 LLM 返回的评分结构：total 为数值，criteria 为对象列表，
+    confidence（如有）为数值，flags（如有）为列表
+    """
+    def is_number(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
     
+    if not isinstance(resp, dict) or not is_number(resp.get("total")):
+        return False
+    criteria = resp.get("criteria")
+    if not isinstance(criteria, list) or not all(isinstance(c, dict) for c in criteria):
+        return False
+    if "confidence" in resp and not is_number(resp["confidence"]):
+        return False
+    return "flags" not in resp or isinstance(resp["flags"], list)
+
+
+def load_cached_grade(cache_dir, key):
+    """读取缓存的评分结果，不存在、损坏或结构无效时返回 None"""
+    if not cache_dir:
+        return None
+    path = os.path.join(cache_dir, key[:2], f"{key}.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            resp = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return resp if is_valid_grade(resp) else None
+
+
+def save_cached_grade(cache_dir, key, resp):
+    """保存 LLM 返回的评分结果（原子写入，多个作业可共享同一缓存目录）"""
+    if not cache_dir:
+        return
+    try:
+        path = os.path.join(cache_dir, key[:2], f"{key}.json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(resp, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Warning: Failed to write grading cache: {e}", file=sys.stderr)
+
+
+def error_result(*flags):
+    """评分失败或无法评分时的结果"""
+    return {
+        "total": 0,
+        "criteria": [],
+        "flags": ["need_review", *flags],
+        "confidence": 0.0
+    }
+
+
+def apply_review_flags(resp, rubric_text):
+    """边界带分数或低置信度的结果加上 need_review 标记"""
     # 边界带自动送审
     try:
         rubric_data = json.loads(rubric_text)
@@ -175,12 +350,123 @@ def main():
         resp["flags"] = sorted(list(flags))
     except Exception:
         pass
+    return resp
+
+
+def add_budget_flags(resp, truncated, tokens_used=0):
+    """记录答案是否被截断，以及本次评分消耗的 token 数（命中缓存或未调用 LLM 时为 0）"""
+    if truncated:
+        resp["flags"] = [*resp.get("flags", []), "answer_truncated"]
+    resp["tokens_used"] = tokens_used
+    return resp
+
+
+def grade_answer(question, answer, rubric_text, api_url, api_key, model, client=None, cache_dir=None,
+                 question_id=None, max_answer_tokens=DEFAULT_MAX_ANSWER_TOKENS, answer_template=None):
+    """
+    为单道简答题评分，返回已加上送审标记的结果
+
+    答案先经过 prepare_answer 压缩和截断（提供 answer_template 时去掉与作答模板相同的行）；
+    提供 question_id 时提示词中只包含量表里该题的部分。
+    提供 cache_dir 时，相同题目/量表/答案/模型的结果直接从缓存读取，不调用 LLM
+    """
+    answer, truncated = prepare_answer(answer, max_answer_tokens, answer_template) if answer else ("", False)
+    tokens_used = 0
+    if not question or not answer:
+        print(f"Warning: Empty question or answer file", file=sys.stderr)
+        resp = error_result("empty_answer")
+    else:
+        key = cache_key(question, rubric_text, answer, model)
+        resp = load_cached_grade(cache_dir, key)
+        if resp is not None:
+            print("Using cached LLM grade", file=sys.stderr)
+        else:
+            # 调用 LLM
+            try:
+                prompt = PROMPT_TEMPLATE.format(
+                    question=question,
+                    rubric=prompt_rubric(rubric_text, [question_id] if question_id else None),
+                    answer=answer
+                )
+                resp, usage = call_llm(api_url, api_key, model, prompt, client=client, with_usage=True)
+                tokens_used = int(usage.get("total_tokens", 0) or 0)
+                if is_valid_grade(resp):
+                    save_cached_grade(cache_dir, key, resp)
+                else:
+                    # 结构无效的结果不缓存，避免之后每次推送都复用
+                    print(f"Invalid LLM grade: {json.dumps(resp, ensure_ascii=False)[:200]}", file=sys.stderr)
+                    resp = error_result("llm_error")
+            except Exception as e:
+                print(f"LLM grading failed: {e}", file=sys.stderr)
+                resp = error_result("llm_error")
     
-    # 保存 grade.json
-    with open(args.out, "w", encoding="utf-8") as f:
-        json.dump(resp, f, ensure_ascii=False, indent=2)
+    return apply_review_flags(add_budget_flags(resp, truncated, tokens_used), rubric_text)
+
+
+def grade_answers_single_call(items, rubric_text, api_url, api_key, model, client=None, cache_dir=None,
+                              max_answer_tokens=DEFAULT_MAX_ANSWER_TOKENS, answer_templates=None):
+    """
+    一次 LLM 调用为多道简答题评分
+
+    items 为 [(id, question, answer), ...]；返回 {id: 结果}。
+    answer_templates 为 {id: 作答模板}，用法同 grade_answer 的 answer_template。
+    空答案和命中缓存的题目不发送给 LLM；响应中缺少的题目记为 llm_error
+    """
+    results = {}
+    truncated = {}
+    to_grade = []
+    for item_id, question, answer in items:
+        template = (answer_templates or {}).get(item_id)
+        answer, truncated[item_id] = prepare_answer(answer, max_answer_tokens, template) if answer else ("", False)
+        if not question or not answer:
+            print(f"Warning: Empty question or answer file ({item_id})", file=sys.stderr)
+            results[item_id] = add_budget_flags(error_result("empty_answer"), truncated[item_id])
+            continue
+        cached = load_cached_grade(cache_dir, cache_key(question, rubric_text, answer, model, "batch"))
+        if cached is not None:
+            print(f"Using cached LLM grade ({item_id})", file=sys.stderr)
+            results[item_id] = add_budget_flags(cached, truncated[item_id])
+        else:
+            to_grade.append((item_id, question, answer))
     
-    # 生成 summary.md
+    if to_grade:
+        prompt = BATCH_PROMPT_TEMPLATE.format(
+            rubric=prompt_rubric(rubric_text, [item_id for item_id, _, _ in to_grade]),
+            items="\n".join(
+                BATCH_ITEM_TEMPLATE.format(id=item_id, question=question, answer=answer)
+                for item_id, question, answer in to_grade
+            )
+        )
+        try:
+            resp, usage = call_llm(api_url, api_key, model, prompt, client=client, with_usage=True)
+            graded = {str(r.get("id", "")).lower(): r for r in resp.get("results", []) if isinstance(r, dict)}
+            # 一次调用的用量按题目平均分摊
+            tokens_each = int(usage.get("total_tokens", 0) or 0) // len(to_grade)
+        except Exception as e:
+            print(f"LLM grading failed: {e}", file=sys.stderr)
+            graded = {}
+            tokens_each = 0
+        
+        for item_id, question, answer in to_grade:
+            r = graded.get(item_id.lower())
+            if r is None:
+                print(f"LLM response missing result for {item_id}", file=sys.stderr)
+                r = error_result("llm_error")
+            else:
+                r.pop("id", None)
+                if is_valid_grade(r):
+                    save_cached_grade(cache_dir, cache_key(question, rubric_text, answer, model, "batch"), r)
+                else:
+                    print(f"Invalid LLM grade for {item_id}: {json.dumps(r, ensure_ascii=False)[:200]}",
+                          file=sys.stderr)
+                    r = error_result("llm_error")
+            results[item_id] = add_budget_flags(r, truncated[item_id], tokens_each)
+    
+    return {item_id: apply_review_flags(resp, rubric_text) for item_id, resp in results.items()}
+
+
+def write_summary(resp, rubric_text, path):
+    """生成 summary.md，返回满分"""
     try:
         rubric_data = json.loads(rubric_text)
         max_score = rubric_data.get("max_score", 10)
@@ -205,13 +491,134 @@ def main():
         if reason:
             lines.append(f"  - {reason}")
     
-    with open(args.summary, "w", encoding="utf-8") as f:
+    with open(path, "w", encoding="utf-8") as f:
         f.write("\n".join(lines))
     
+    return max_score
+
+
+def find_question_files(questions_dir):
+    """按编号顺序列出 questions 目录下的 saN.md"""
+    numbered = []
+    for f in Path(questions_dir).glob("sa*.md"):
+        match = re.fullmatch(r"sa(\d+)\.md", f.name)
+        if match:
+            numbered.append((int(match.group(1)), f))
+    return [f for _, f in sorted(numbered)]
+
+
+def grade_batch(args, rubric_text):
+    """
+    批量评分：为 questions_dir 中的每道题评分
+
+    每题输出 {out_dir}/saN_grade.json 和 saN_summary.md，与逐题调用的输出相同，
+    可直接交给 aggregate_llm_grades.py 聚合
+    """
+    question_files = find_question_files(args.questions_dir)
+    if not question_files:
+        print(f"Warning: No questions found in {args.questions_dir}", file=sys.stderr)
+        return
+    
+    items = []
+    answer_templates = {}
+    for question_file in question_files:
+        item_id = question_file.stem
+        question = read_file(str(question_file)).strip()
+        answer = read_file(os.path.join(args.answers_dir, question_file.name)).strip()
+        items.append((item_id, question, answer))
+        answer_templates[item_id] = load_answer_template(args.templates_dir, item_id)
+    
+    os.makedirs(args.out_dir, exist_ok=True)
+    
+    workers = max(1, args.workers)
+    with LLMClient(args.api_url, args.api_key, args.model, pool_size=workers) as client:
+        if args.strategy == "single":
+            results = grade_answers_single_call(items, rubric_text, args.api_url, args.api_key, args.model,
+                                                client=client, cache_dir=args.cache_dir,
+                                                max_answer_tokens=args.max_answer_tokens,
+                                                answer_templates=answer_templates)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    item_id: executor.submit(grade_answer, question, answer, rubric_text,
+                                             args.api_url, args.api_key, args.model, client, args.cache_dir,
+                                             item_id, args.max_answer_tokens, answer_templates[item_id])
+                    for item_id, question, answer in items
+                }
+                results = {item_id: future.result() for item_id, future in futures.items()}
+    
+    for item_id, _, _ in items:
+        resp = results[item_id]
+        with open(os.path.join(args.out_dir, f"{item_id}_grade.json"), "w", encoding="utf-8") as f:
+            json.dump(resp, f, ensure_ascii=False, indent=2)
+        max_score = write_summary(resp, rubric_text, os.path.join(args.out_dir, f"{item_id}_summary.md"))
+        print(f"{item_id.upper()} LLM grading complete: {resp.get('total', 0):.2f}/{max_score}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grade short answer questions using LLM")
+    parser.add_argument("--question", help="Path to question file")
+    parser.add_argument("--answer", help="Path to answer file")
+    parser.add_argument("--rubric", required=True, help="Path to rubric JSON file")
+    parser.add_argument("--out", default="grade.json", help="Output JSON file")
+    parser.add_argument("--summary", default="summary.md", help="Output summary markdown file")
+    parser.add_argument("--batch", action="store_true",
+                        help="Grade every questions/saN.md with answers/saN.md in one run")
+    parser.add_argument("--questions-dir", default="questions", help="Batch mode: directory of saN.md questions")
+    parser.add_argument("--answers-dir", default="answers", help="Batch mode: directory of saN.md answers")
+    parser.add_argument("--out-dir", default="artifacts",
+                        help="Batch mode: output directory for saN_grade.json / saN_summary.md")
+    parser.add_argument("--strategy", choices=["concurrent", "single"], default=os.getenv("LLM_BATCH_STRATEGY", "concurrent"),
+                        help="Batch mode: concurrent per-question calls, or one structured call for all questions")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("LLM_WORKERS", "4")),
+                        help="Batch mode: concurrent LLM calls")
+    parser.add_argument("--cache-dir", default=os.getenv("LLM_CACHE_DIR", ""),
+                        help="Reuse grades of unchanged answers from this directory (e.g. a runner volume)")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore LLM_CACHE_DIR and always call the LLM")
+    parser.add_argument("--max-answer-tokens", type=int, default=DEFAULT_MAX_ANSWER_TOKENS,
+                        help="Truncate each answer to about this many tokens, keeping head and tail (0 = no limit)")
+    parser.add_argument("--templates-dir", default=DEFAULT_TEMPLATES_DIR,
+                        help="Directory of answer templates (saN.md); unchanged template lines are not graded")
+    parser.add_argument("--model", default=os.getenv("LLM_MODEL", "deepseek-chat"))
+    parser.add_argument("--api_url", default=os.getenv("LLM_API_URL", "https://api.deepseek.com/chat/completions"))
+    parser.add_argument("--api_key", default=os.getenv("LLM_API_KEY", ""))
+    args = parser.parse_args()
+    
+    if not args.batch and not (args.question and args.answer):
+        parser.error("--question and --answer are required unless --batch is given")
+    
+    # 验证必需的配置
+    if not args.api_key:
+        print("Warning: LLM_API_KEY not set. LLM grading may fail.", file=sys.stderr)
+    
+    rubric_text = read_file(args.rubric).strip()
+    if args.no_cache:
+        args.cache_dir = ""
+    
+    if args.batch:
+        grade_batch(args, rubric_text)
+        return
+    
+    # 读取文件
+    question = read_file(args.question).strip()
+    answer = read_file(args.answer).strip()
+    
+    question_id = Path(args.question).stem
+    resp = grade_answer(question, answer, rubric_text, args.api_url, args.api_key, args.model,
+                        cache_dir=args.cache_dir,
+                        question_id=question_id if re.fullmatch(r"sa\d+", question_id) else None,
+                        max_answer_tokens=args.max_answer_tokens,
+                        answer_template=load_answer_template(args.templates_dir, question_id))
+    
+    # 保存 grade.json
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(resp, f, ensure_ascii=False, indent=2)
+    
+    # 生成 summary.md
+    max_score = write_summary(resp, rubric_text, args.summary)
+    
     print(f"LLM grading complete: {resp.get('total', 0):.2f}/{max_score}")
 
 
 if __name__ == "__main__":
     main()
-
-
@@ -26,6 +26,7 @@ def aggregate_grades(input_files, output_file, summary_file):
     total_score = 0
     max_score = 0
     need_review_count = 0
+    tokens_used = 0
     
     for input_file in input_files:
         grade = load_grade(input_file)
@@ -39,6 +40,7 @@ def aggregate_grades(input_files, output_file, summary_file):
             # 检查是否需要审核
             if 'need_review' in grade.get('flags', []) or grade.get('need_review', False):
                 need_review_count += 1
+            tokens_used += grade.get('tokens_used', 0)
     
     # 计算总分
     final_score = total_score if max_score > 0 else 0
@@ -50,6 +52,7 @@ def aggregate_grades(input_files, output_file, summary_file):
         'max_score': final_max_score,
         'questions': len(grades),
         'need_review': need_review_count > 0,
+        'tokens_used': tokens_used,
         'details': grades
     }
     
@@ -133,6 +133,7 @@ def create_llm_metadata(llm_grade_file='artifacts/llm_grade.json'):
         total_score = llm_data.get("total_score", llm_data.get("total", 0))
         max_score = llm_data.get("max_score", 30)
         need_review = llm_data.get("need_review", False)
+        tokens_used = llm_data.get("tokens_used", 0)
         questions_data = llm_data.get("details", llm_data.get("questions", []))
         
         # 构建各题详情
@@ -173,6 +174,7 @@ def create_llm_metadata(llm_grade_file='artifacts/llm_grade.json'):
             "details": {
                 "questions": len(question_details),
                 "need_review": need_review,
+                "tokens_used": tokens_used,
                 "question_details": question_details
             }
         }
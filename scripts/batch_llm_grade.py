@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+离线批量 LLM 简答题评分（教师端）
+
+截止后一次性为全班评分：从本地克隆的学生仓库或 Gitea API 读取 answers/saN.md，
+相同答案只评分一次，通过共享的 LLM 客户端并发评分，
+为每个学生输出与 CI 相同的 saN_grade.json、llm_grade.json 和 metadata.json
+
+用法:
+    python scripts/batch_llm_grade.py --course courses/CS101 --assignment hw1
+    python scripts/batch_llm_grade.py --course courses/CS101 --assignment hw1 --repos-dir clones/hw1
+"""
+
+import os
+import sys
+import io
+import csv
+import json
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import yaml
+from dotenv import load_dotenv
+
+from gitea_client import GiteaClient
+from repo_cache import OrgRepoIndex
+
+# 评分逻辑与 CI 中的 .autograde 脚本共用
+sys.path.insert(0, str(Path(__file__).resolve().parent / "autograde"))
+from llm_grade import grade_answer, find_question_files, read_file  # noqa: E402
+from llm_client import LLMClient  # noqa: E402
+from aggregate_llm_grades import aggregate_grades  # noqa: E402
+from create_minimal_metadata import create_llm_metadata  # noqa: E402
+
+load_dotenv()
+
+
+def list_local_students(repos_dir, prefix):
+    """本地克隆目录中的学生仓库：{仓库名: 仓库目录}"""
+    return {
+        d.name: d for d in sorted(Path(repos_dir).iterdir())
+        if d.is_dir() and d.name.startswith(prefix)
+    }
+
+
+def fetch_answer(client, org, repo_name, path, ref):
+    """通过 raw 文件 API 读取学生仓库中的答案文件；文件不存在时返回空字符串"""
+    response = client.get(f"/repos/{org}/{repo_name}/raw/{path}", params={"ref": ref})
+    if response.status_code == 404:
+        return ""
+    response.raise_for_status()
+    response.encoding = "utf-8"
+    return response.text
+
+
+def load_answers(args, client, org, students, question_ids):
+    """
+    读取所有学生的答案
+
+    返回 {仓库名: {题目编号: 答案}}，读取失败的学生不包含在结果中
+    """
+    answers = {}
+    if args.repos_dir:
+        for repo_name, repo_dir in students.items():
+            answers[repo_name] = {
+                qid: read_file(str(repo_dir / "answers" / f"{qid}.md")).strip()
+                for qid in question_ids
+            }
+        return answers
+
+    def fetch_student(repo_name):
+        return {
+            qid: fetch_answer(client, org, repo_name, f"answers/{qid}.md", args.ref).strip()
+            for qid in question_ids
+        }
+
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {executor.submit(fetch_student, repo_name): repo_name for repo_name in students}
+        for future in as_completed(futures):
+            repo_name = futures[future]
+            try:
+                answers[repo_name] = future.result()
+            except Exception as e:
+                print(f"Error fetching answers of {repo_name}: {e}", file=sys.stderr)
+    return answers
+
+
+def write_student_results(out_dir, org, repo_name, student_id, assignment, question_ids, grades):
+    """
+    写出单个学生的评分结果
+
+    saN_grade.json 与 CI 中 llm_grade.py 的输出相同，llm_grade.json / llm_summary.md
+    由 aggregate_llm_grades 生成，metadata.json 由 create_llm_metadata 生成
+    """
+    student_dir = Path(out_dir) / repo_name
+    student_dir.mkdir(parents=True, exist_ok=True)
+
+    grade_files = []
+    for qid in question_ids:
+        grade_file = student_dir / f"{qid}_grade.json"
+        with open(grade_file, "w", encoding="utf-8") as f:
+            json.dump(grades[qid], f, ensure_ascii=False, indent=2)
+        grade_files.append(str(grade_file))
+
+    llm_grade_file = student_dir / "llm_grade.json"
+    with contextlib.redirect_stdout(io.StringIO()):
+        aggregate_grades(grade_files, str(llm_grade_file), str(student_dir / "llm_summary.md"))
+
+    # create_llm_metadata 从环境变量读取学生和作业信息
+    os.environ.update({"REPO": f"{org}/{repo_name}", "STUDENT_ID": student_id, "ASSIGNMENT_ID": assignment})
+    metadata = create_llm_metadata(str(llm_grade_file))
+    with open(student_dir / "metadata.json", "w", encoding="utf-8") as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+    with open(llm_grade_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="离线批量 LLM 简答题评分（截止后为全班评分）",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+  # 通过 Gitea API 读取所有学生的答案
+  python scripts/batch_llm_grade.py --course courses/CS101 --assignment hw1
+
+  # 使用本地已克隆的学生仓库（目录下每个子目录是一个学生仓库）
+  python scripts/batch_llm_grade.py --course courses/CS101 --assignment hw1 --repos-dir clones/hw1
+        """
+    )
+
+    # Required arguments
+    parser.add_argument("--course", required=True, help="课程路径 (例如: courses/CS101)")
+    parser.add_argument("--assignment", required=True, help="作业ID (例如: hw1)")
+
+    # Optional arguments
+    parser.add_argument("--repos-dir", help="本地克隆的学生仓库目录（不指定时通过 Gitea API 读取答案）")
+    parser.add_argument("--ref", default="main", help="读取答案的分支 (默认: main)")
+    parser.add_argument("--rubric", help="评分量表 (默认: {assignment}/tests/llm/rubric.json)")
+    parser.add_argument("--output", help="输出目录 (默认: llm_grades_{assignment})")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("LLM_WORKERS", "8")),
+                        help="并发 LLM 调用数")
+    parser.add_argument("--cache-dir", default=os.getenv("LLM_CACHE_DIR", ""),
+                        help="评分缓存目录（与 CI 共用同一目录时可复用已有评分）")
+    parser.add_argument("--gitea-url", default=os.getenv("GITEA_URL", "http://localhost:3000"))
+    parser.add_argument("--token", default=os.getenv("GITEA_ADMIN_TOKEN", ""))
+    parser.add_argument("--model", default=os.getenv("LLM_MODEL", "deepseek-chat"))
+    parser.add_argument("--api_url", default=os.getenv("LLM_API_URL", "https://api.deepseek.com/chat/completions"))
+    parser.add_argument("--api_key", default=os.getenv("LLM_API_KEY", ""))
+
+    args = parser.parse_args()
+
+    if not args.api_key:
+        print("Warning: LLM_API_KEY not set. LLM grading may fail.", file=sys.stderr)
+    if not args.repos_dir and not args.token:
+        print("Error: GITEA_ADMIN_TOKEN not set (required unless --repos-dir is given)", file=sys.stderr)
+        sys.exit(1)
+
+    # Load course config
+    try:
+        with open(Path(args.course) / "course_config.yaml") as f:
+            course_config = yaml.safe_load(f)
+        org = course_config.get("organization")
+        if not org:
+            print("Error: 'organization' not defined in course config", file=sys.stderr)
+            sys.exit(1)
+    except Exception as e:
+        print(f"Error loading course config: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    assignment_dir = Path(args.course) / "assignments" / args.assignment
+    prefix = f"{args.assignment}-stu"
+    output_dir = Path(args.output or f"llm_grades_{args.assignment}")
+
+    # 题目和评分量表（与 CI 中使用的相同）
+    question_files = find_question_files(assignment_dir / "template" / "questions")
+    if not question_files:
+        print(f"Error: No questions/saN.md found in {assignment_dir / 'template'}", file=sys.stderr)
+        sys.exit(1)
+    questions = {f.stem: read_file(str(f)).strip() for f in question_files}
+    question_ids = list(questions)
+    # 作答模板，与模板相同的行（未修改的占位内容）不发送给 LLM
+    answer_templates = {
+        qid: read_file(str(assignment_dir / "template" / "answers" / f"{qid}.md"))
+        for qid in question_ids
+    }
+    rubric_path = args.rubric or assignment_dir / "tests" / "llm" / "rubric.json"
+    rubric_text = read_file(str(rubric_path)).strip()
+    if not rubric_text:
+        print(f"Error: Rubric not found: {rubric_path}", file=sys.stderr)
+        sys.exit(1)
+
+    # 学生列表
+    client = None
+    if args.repos_dir:
+        students = list_local_students(args.repos_dir, prefix)
+    else:
+        client = GiteaClient(args.gitea_url, args.token, pool_size=max(1, args.workers))
+        try:
+            students = {repo["name"]: None for repo in OrgRepoIndex(client, org).with_prefix(prefix)}
+        except Exception as e:
+            print(f"Error listing repositories of {org}: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    print(f"📝 {len(students)} students, {len(question_ids)} questions ({', '.join(question_ids)})")
+    if not students:
+        return
+
+    answers = load_answers(args, client, org, students, question_ids)
+
+    # 相同题目的相同答案只评分一次
+    unique = {}
+    for student_answers in answers.values():
+        for qid, answer in student_answers.items():
+            unique.setdefault((qid, answer), None)
+    total_answers = sum(len(a) for a in answers.values())
+    print(f"🔍 {total_answers} answers, {len(unique)} unique")
+
+    print(f"🤖 Grading with {args.workers} workers...")
+    with LLMClient(args.api_url, args.api_key, args.model, pool_size=max(1, args.workers)) as llm:
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+            futures = {
+                executor.submit(grade_answer, questions[qid], answer, rubric_text,
+                                args.api_url, args.api_key, args.model, llm, args.cache_dir, qid,
+                                answer_template=answer_templates[qid]): (qid, answer)
+                for qid, answer in unique
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                unique[futures[future]] = future.result()
+                if done % 20 == 0 or done == len(futures):
+                    print(f"  [{done}/{len(futures)}] graded")
+        usage = dict(llm.usage)
+
+    # 输出每个学生的结果
+    rows = []
+    charged = set()
+    for repo_name in sorted(answers):
+        student_id = repo_name[len(prefix):].lstrip("_-")
+        grades = {}
+        for qid in question_ids:
+            item = (qid, answers[repo_name][qid])
+            # 每个学生使用独立的副本，避免共享同一结果对象；token 用量只计入第一个学生
+            grades[qid] = json.loads(json.dumps(unique[item]))
+            if item in charged:
+                grades[qid]["tokens_used"] = 0
+            charged.add(item)
+        result = write_student_results(output_dir, org, repo_name, student_id, args.assignment,
+                                       question_ids, grades)
+        rows.append({
+            "student_repo": repo_name,
+            "student_id": student_id,
+            "total_score": round(float(result["total_score"]), 2),
+            "max_score": result["max_score"],
+            "need_review": result["need_review"],
+        })
+
+    summary_file = output_dir / "summary.csv"
+    with open(summary_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["student_repo", "student_id", "total_score", "max_score", "need_review"])
+        writer.writeheader()
+        writer.writerows(rows)
+
+    review_count = sum(1 for r in rows if r["need_review"])
+    print()
+    print(f"✅ Graded {len(rows)} students")
+    print(f"   LLM requests: {usage['requests']} (retries: {usage['retries']}), "
+          f"tokens: {usage['total_tokens']}")
+    print(f"   Need review: {review_count}")
+    print(f"   Results: {output_dir}/<repo>/ (llm_grade.json, metadata.json)")
+    print(f"   Summary: {summary_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+LLM 评分流程压测
+
+在进程内启动 mock_llm_server，生成若干模拟学生提交，按 CI 的方式运行
+`.autograde/llm_grade.py --batch` 和 `aggregate_llm_grades.py`，
+统计吞吐量、端到端延迟和重试情况。使用相同的 --seed 时结果可重复。
+
+用法:
+    python scripts/bench_llm_grade.py --students 50 --latency 0.5 --rate-limit-rate 0.1
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from mock_llm_server import add_server_arguments, create_server
+
+AUTOGRADE_DIR = Path(__file__).resolve().parent / "autograde"
+
+WORDS = ("数据", "变量", "函数", "循环", "向量", "模型", "分布", "样本", "均值", "方差",
+         "the", "data", "frame", "value", "result", "test", "model", "error")
+
+
+def percentile(values, pct):
+    """最近秩法百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def make_submissions(work_dir, students, questions, answer_words, seed):
+    """生成题目、量表和每个学生的 answers/saN.md，返回学生目录列表"""
+    rng = random.Random(seed)
+    questions_dir = work_dir / "questions"
+    questions_dir.mkdir(parents=True)
+    for q in range(1, questions + 1):
+        (questions_dir / f"sa{q}.md").write_text(f"第 {q} 题：请简述{rng.choice(WORDS)}的含义。\n", encoding="utf-8")
+    rubric_path = work_dir / "rubric.json"
+    rubric_path.write_text(json.dumps({"max_score": 10, "borderline_band": [7, 8]}), encoding="utf-8")
+
+    student_dirs = []
+    for s in range(1, students + 1):
+        student_dir = work_dir / "students" / f"stu_{s:03d}"
+        (student_dir / "answers").mkdir(parents=True)
+        for q in range(1, questions + 1):
+            answer = " ".join(rng.choice(WORDS) for _ in range(answer_words))
+            (student_dir / "answers" / f"sa{q}.md").write_text(answer + "\n", encoding="utf-8")
+        student_dirs.append(student_dir)
+    return questions_dir, rubric_path, student_dirs
+
+
+def run_student(student_dir, questions_dir, rubric_path, env, strategy, workers):
+    """按 CI 的步骤为一个学生评分并聚合，返回计时和结果"""
+    out_dir = student_dir / "artifacts"
+    start = time.monotonic()
+    subprocess.run(
+        [sys.executable, str(AUTOGRADE_DIR / "llm_grade.py"), "--batch",
+         "--questions-dir", str(questions_dir), "--answers-dir", str(student_dir / "answers"),
+         "--rubric", str(rubric_path), "--out-dir", str(out_dir),
+         "--strategy", strategy, "--workers", str(workers), "--no-cache"],
+        check=True, capture_output=True, text=True, env=env
+    )
+    grade_time = time.monotonic() - start
+
+    start = time.monotonic()
+    subprocess.run(
+        [sys.executable, str(AUTOGRADE_DIR / "aggregate_llm_grades.py"),
+         "--inputs", *sorted(str(p) for p in out_dir.glob("sa*_grade.json")),
+         "--out", str(out_dir / "llm_grade.json"), "--summary", str(out_dir / "llm_summary.md")],
+        check=True, capture_output=True, text=True, env=env
+    )
+    aggregate_time = time.monotonic() - start
+
+    failed = 0
+    for grade_file in out_dir.glob("sa*_grade.json"):
+        with open(grade_file, "r", encoding="utf-8") as f:
+            if "llm_error" in json.load(f).get("flags", []):
+                failed += 1
+    return grade_time, aggregate_time, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="使用本地模拟 LLM 服务压测 llm_grade.py / aggregate_llm_grades.py",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+  # 50 个学生，每次调用 0.5 秒，10% 的请求返回 429
+  python scripts/bench_llm_grade.py --students 50 --latency 0.5 --rate-limit-rate 0.1
+
+  # 对比一次结构化调用评分所有题目
+  python scripts/bench_llm_grade.py --students 50 --latency 0.5 --strategy single
+        """
+    )
+    parser.add_argument("--students", type=int, default=20, help="模拟学生数")
+    parser.add_argument("--questions", type=int, default=3, help="每个学生的简答题数")
+    parser.add_argument("--answer-words", type=int, default=80, help="每个答案的词数")
+    parser.add_argument("--parallel", type=int, default=4, help="同时运行的学生评分数（模拟 Runner 并发作业数）")
+    parser.add_argument("--strategy", choices=["concurrent", "single"], default="concurrent",
+                        help="传给 llm_grade.py 的批量评分方式")
+    parser.add_argument("--workers", type=int, default=4, help="传给 llm_grade.py 的并发调用数")
+    parser.add_argument("--keep", action="store_true", help="保留生成的提交和评分结果目录")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = create_server(args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    env = dict(os.environ, LLM_API_URL=server.url, LLM_API_KEY="mock", LLM_MODEL="mock",
+               LLM_MAX_RETRIES=os.getenv("LLM_MAX_RETRIES", "5"))
+    work_dir = Path(tempfile.mkdtemp(prefix="llm_bench_"))
+    questions_dir, rubric_path, student_dirs = make_submissions(
+        work_dir, args.students, args.questions, args.answer_words, args.seed
+    )
+
+    print(f"🤖 Mock LLM ({args.mode}) at {server.url}")
+    print(f"📝 {args.students} students x {args.questions} questions, parallel={args.parallel}, "
+          f"strategy={args.strategy}, workers={args.workers}")
+
+    grade_times, aggregate_times, failed, errors = [], [], 0, 0
+    start = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.parallel)) as executor:
+            futures = [
+                executor.submit(run_student, student_dir, questions_dir, rubric_path, env,
+                                args.strategy, args.workers)
+                for student_dir in student_dirs
+            ]
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    grade_time, aggregate_time, student_failed = future.result()
+                    grade_times.append(grade_time)
+                    aggregate_times.append(aggregate_time)
+                    failed += student_failed
+                except subprocess.CalledProcessError as e:
+                    errors += 1
+                    print(f"Error: {e.cmd[1]} exited with {e.returncode}: {e.stderr.strip()[-200:]}",
+                          file=sys.stderr)
+                if done % 10 == 0 or done == len(futures):
+                    print(f"  [{done}/{len(futures)}] students graded")
+        elapsed = time.monotonic() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    stats = server.stats
+    answers = args.students * args.questions
+    print()
+    print("📊 Results")
+    print(f"   Wall time: {elapsed:.2f}s, throughput: {answers / elapsed:.2f} answers/s, "
+          f"{args.students / elapsed:.2f} students/s")
+    print(f"   llm_grade.py latency: p50 {percentile(grade_times, 50):.2f}s, "
+          f"p95 {percentile(grade_times, 95):.2f}s, max {max(grade_times, default=0):.2f}s")
+    print(f"   aggregate_llm_grades.py latency: p50 {percentile(aggregate_times, 50):.2f}s, "
+          f"max {max(aggregate_times, default=0):.2f}s")
+    print(f"   LLM requests: {stats['requests']} (ok {stats['ok']}, injected 429 {stats['injected_429']}, "
+          f"injected 5xx {stats['injected_5xx']})")
+    if args.mode == "replay":
+        print(f"   Replay hits: {stats['replay_hits']}, misses: {stats['replay_misses']}")
+    print(f"   Tokens: prompt {stats['prompt_tokens']}, completion {stats['completion_tokens']}")
+    print(f"   Failed answers (llm_error): {failed}, failed runs: {errors}")
+    if args.keep:
+        print(f"   Work dir: {work_dir}")
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,18 +8,22 @@
 
 import os
 import sys
-from typing import Optional
 import argparse
 import requests
 import csv
 import json
 import base64
+import sqlite3
+import subprocess
 import yaml
 from pathlib import Path
 from dotenv import load_dotenv
 from datetime import datetime
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urlparse
+from gitea_client import GiteaClient, detect_host
+from repo_cache import DEFAULT_CACHE_DIR
 
 load_dotenv()
 
@@ -31,37 +35,122 @@ def load_course_config(course_dir):
     with open(config_path, 'r') as f:
         return yaml.safe_load(f)
 
-def detect_host(server_url: str, external_host: Optional[str]) -> str:
-    """检测 Gitea 主机地址"""
-    parsed = urlparse(server_url)
-    raw_host = parsed.netloc or parsed.path.split("/")[0]
-    host = raw_host
-    if raw_host.lower().startswith("gitea"):
-        host = external_host or "localhost:3000"
-    return host
+def find_subtree_sha(client, tree_api, ref, path, per_page=1000):
+    """
+    逐级非递归查找 path 对应子目录的 tree SHA
+
+    每级只列出当前目录的直接子项；路径不存在时返回 None，HTTP 错误抛出 requests.HTTPError
+    """
+    sha = ref
+    for name in path.strip("/").split("/"):
+        found = None
+        page = 1
+        while found is None:
+            response = client.get(f"{tree_api}/{sha}", params={"page": page, "per_page": per_page}, timeout=60)
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            data = response.json()
+            entries = data.get("tree") or []
+            for entry in entries:
+                if entry.get("path") == name and entry.get("type") == "tree":
+                    found = entry.get("sha")
+                    break
+            if found is None and (not data.get("truncated") or not entries):
+                return None
+            page += 1
+        sha = found
+    return sha
 
 
-def list_metadata_files(gitea_url, token, metadata_repo, branch="main", path="records"):
+def list_metadata_tree(client, metadata_repo, branch="main", path="records", per_page=1000):
     """
-    列出 metadata 仓库中指定路径下的所有文件
+    通过 git trees API 递归列出 metadata 仓库中指定路径下的所有 JSON 文件
+
+    指定 path 时先逐级查找该子目录的 tree SHA，只递归列出这棵子树（不遍历其他作业），
+    请求数与文件数量无关。返回与 contents API 相同结构的 dict 列表（包含 path 和 blob sha）；
+    请求失败时返回 None，由调用方回退到逐目录遍历
     """
     try:
         owner, repo_name = metadata_repo.split("/", 1)
     except ValueError:
         print(f"Error: Invalid metadata repo format: {metadata_repo}", file=sys.stderr)
-        print(f"Expected format: owner/repo", file=sys.stderr)
+        return None
+    
+    tree_api = f"/repos/{owner}/{repo_name}/git/trees"
+    prefix = path.strip("/") + "/" if path and path.strip("/") else ""
+    
+    try:
+        tree_sha = find_subtree_sha(client, tree_api, branch, prefix, per_page) if prefix else branch
+    except Exception as e:
+        print(f"Error listing tree of {metadata_repo}@{branch}: {e}", file=sys.stderr)
+        return None
+    if tree_sha is None:
+        # 分支、仓库或目录不存在
         return []
     
-    # 检测主机地址
-    external_host = os.getenv("EXTERNAL_GITEA_HOST")
-    host = detect_host(gitea_url, external_host)
+    all_files = []
+    page = 1
     
-    api_url = f"http://{host}/api/v1/repos/{owner}/{repo_name}/contents/{path}"
+    while True:
+        params = {
+            "recursive": "true",
+            "page": page,
+            "per_page": per_page
+        }
+        try:
+            response = client.get(f"{tree_api}/{tree_sha}", params=params, timeout=60)
+            if response.status_code == 404:
+                return []
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            print(f"Error listing tree of {metadata_repo}@{branch}: {e}", file=sys.stderr)
+            return None
+        
+        entries = data.get("tree") or []
+        for entry in entries:
+            # 子树中的路径相对于子目录，加上前缀还原为仓库内路径
+            entry_path = prefix + entry.get("path", "")
+            if entry.get("type") == "blob" and entry_path.endswith(".json"):
+                all_files.append({
+                    "type": "file",
+                    "path": entry_path,
+                    "sha": entry.get("sha"),
+                    "size": entry.get("size")
+                })
+        
+        if not data.get("truncated") or not entries:
+            break
+        page += 1
     
-    headers = {
-        "Authorization": f"token {token}",
-        "Content-Type": "application/json"
-    }
+    return all_files
+
+
+def list_metadata_files(client, metadata_repo, branch="main", path="records"):
+    """
+    列出 metadata 仓库中指定路径下的所有文件
+
+    优先使用 git trees API（一次或少数几次请求），失败时回退到逐目录遍历 contents API
+    """
+    tree_files = list_metadata_tree(client, metadata_repo, branch, path)
+    if tree_files is not None:
+        return tree_files
+    
+    print("   Falling back to per-directory listing...", file=sys.stderr)
+    return traverse_metadata_contents(client, metadata_repo, branch, path)
+
+
+def traverse_metadata_contents(client, metadata_repo, branch="main", path="records"):
+    """
+    通过 contents API 逐目录递归列出指定路径下的所有 JSON 文件
+    """
+    try:
+        owner, repo_name = metadata_repo.split("/", 1)
+    except ValueError:
+        print(f"Error: Invalid metadata repo format: {metadata_repo}", file=sys.stderr)
+        print(f"Expected format: owner/repo", file=sys.stderr)
+        return []
     
     params = {
         "ref": branch
@@ -71,10 +160,10 @@ def list_metadata_files(gitea_url, token, metadata_repo, branch="main", path="re
     
     def traverse_directory(current_path):
         """递归遍历目录"""
-        current_api_url = f"http://{host}/api/v1/repos/{owner}/{repo_name}/contents/{current_path}"
+        current_api_path = f"/repos/{owner}/{repo_name}/contents/{current_path}"
         
         try:
-            response = requests.get(current_api_url, headers=headers, params=params, timeout=30)
+            response = client.get(current_api_path, params=params)
             response.raise_for_status()
             items = response.json()
             
@@ -102,7 +191,7 @@ def list_metadata_files(gitea_url, token, metadata_repo, branch="main", path="re
     return all_files
 
 
-def download_metadata_file(gitea_url, token, metadata_repo, file_path, branch="main"):
+def download_metadata_file(client, metadata_repo, file_path, branch="main"):
     """
     下载并解析 metadata JSON 文件
     """
@@ -111,23 +200,14 @@ def download_metadata_file(gitea_url, token, metadata_repo, file_path, branch="m
     except ValueError:
         return None
     
-    # 检测主机地址
-    external_host = os.getenv("EXTERNAL_GITEA_HOST")
-    host = detect_host(gitea_url, external_host)
-    
-    api_url = f"http://{host}/api/v1/repos/{owner}/{repo_name}/contents/{file_path}"
-    
-    headers = {
-        "Authorization": f"token {token}",
-        "Content-Type": "application/json"
-    }
+    api_path = f"/repos/{owner}/{repo_name}/contents/{file_path}"
     
     params = {
         "ref": branch
     }
     
     try:
-        response = requests.get(api_url, headers=headers, params=params, timeout=30)
+        response = client.get(api_path, params=params)
         response.raise_for_status()
         file_info = response.json()
         
@@ -145,6 +225,160 @@ def download_metadata_file(gitea_url, token, metadata_repo, file_path, branch="m
         return None
 
 
+def download_metadata_files(client, metadata_repo, file_paths, branch="main", workers=8):
+    """
+    并发下载 metadata 文件
+
+    使用有界线程池下载，每完成一个文件就 yield (file_path, metadata)，
+    完成顺序与 file_paths 顺序无关；下载失败时 metadata 为 None。
+    对主机的并发连接数由 client 的连接池大小限制
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(download_metadata_file, client, metadata_repo, file_path, branch): file_path
+            for file_path in file_paths
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def sync_metadata_mirror(client, metadata_repo, branch="main", mirror_dir=None):
+    """
+    同步 metadata 仓库到本地持久镜像（浅克隆）
+
+    首次运行时初始化仓库，之后每次只 fetch 指定分支的最新提交。
+    Token 只出现在 fetch 命令行中，不会写入镜像的 git 配置。
+    返回镜像目录路径，失败时返回 None
+    """
+    try:
+        owner, repo_name = metadata_repo.split("/", 1)
+    except ValueError:
+        print(f"Error: Invalid metadata repo format: {metadata_repo}", file=sys.stderr)
+        return None
+    
+    mirror_dir = Path(mirror_dir) if mirror_dir else DEFAULT_CACHE_DIR / "metadata" / owner / repo_name
+    
+    token = client.token
+    parsed = urlparse(client.base_url)
+    fetch_url = f"{parsed.scheme}://oauth2:{token}@{parsed.netloc}/{owner}/{repo_name}.git"
+    
+    try:
+        if not (mirror_dir / ".git").is_dir():
+            mirror_dir.mkdir(parents=True, exist_ok=True)
+            subprocess.run(["git", "init", "-q", str(mirror_dir)], check=True, capture_output=True, text=True)
+        
+        subprocess.run(
+            ["git", "-C", str(mirror_dir), "fetch", "--depth", "1", "--no-tags", fetch_url, branch],
+            check=True,
+            capture_output=True,
+            text=True
+        )
+        subprocess.run(
+            ["git", "-C", str(mirror_dir), "checkout", "-q", "--force", "--detach", "FETCH_HEAD"],
+            check=True,
+            capture_output=True,
+            text=True
+        )
+    except subprocess.CalledProcessError as e:
+        stderr = (e.stderr or "").replace(token, "***") if token else e.stderr
+        print(f"Error syncing metadata mirror: {stderr}", file=sys.stderr)
+        return None
+    
+    return mirror_dir
+
+
+def list_local_metadata_files(mirror_dir, path):
+    """
+    列出本地镜像中指定路径下的所有 JSON 文件
+
+    返回格式与 list_metadata_files 相同（包含 path 字段的 dict 列表）
+    """
+    base = Path(mirror_dir)
+    root = base / path
+    if not root.is_dir():
+        return []
+    files = []
+    for file in sorted(root.rglob("*.json")):
+        rel_path = file.relative_to(base).as_posix()
+        if file.is_file() and not rel_path.startswith(".git/"):
+            files.append({"type": "file", "path": rel_path})
+    return files
+
+
+def read_local_metadata_files(mirror_dir, file_paths):
+    """
+    从本地镜像读取 metadata 文件
+
+    与 download_metadata_files 一样 yield (file_path, metadata)；解析失败时 metadata 为 None
+    """
+    base = Path(mirror_dir)
+    for file_path in file_paths:
+        try:
+            with open(base / file_path, "r", encoding="utf-8") as f:
+                yield file_path, json.load(f)
+        except Exception as e:
+            print(f"Error reading {file_path}: {e}", file=sys.stderr)
+            yield file_path, None
+
+
+def open_record_cache(cache_path):
+    """
+    打开（或创建）本地 metadata 记录缓存
+
+    记录路径中包含 run_id 和 commit SHA，内容不会变化，
+    因此以 path 为键、以列表中的 blob SHA 校验即可
+    """
+    cache_path = Path(cache_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(cache_path))
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS records ("
+        " path TEXT PRIMARY KEY,"
+        " sha TEXT NOT NULL,"
+        " content TEXT NOT NULL)"
+    )
+    return conn
+
+
+def load_cached_records(conn, file_shas):
+    """
+    从缓存中取出 blob SHA 未变化的记录
+
+    file_shas: {file_path: sha}；返回 {file_path: metadata}
+    """
+    cached = {}
+    for file_path, sha in file_shas.items():
+        if not sha:
+            continue
+        row = conn.execute("SELECT sha, content FROM records WHERE path = ?", (file_path,)).fetchone()
+        if row and row[0] == sha:
+            try:
+                cached[file_path] = json.loads(row[1])
+            except json.JSONDecodeError:
+                continue
+    return cached
+
+
+def iter_cached_and_downloaded(conn, cached, downloaded, file_shas):
+    """
+    先 yield 缓存命中的记录，再 yield 新下载的记录并写入缓存
+    """
+    for file_path, metadata in cached.items():
+        yield file_path, metadata
+    
+    try:
+        for file_path, metadata in downloaded:
+            sha = file_shas.get(file_path)
+            if metadata and sha:
+                conn.execute(
+                    "INSERT OR REPLACE INTO records (path, sha, content) VALUES (?, ?, ?)",
+                    (file_path, sha, json.dumps(metadata, ensure_ascii=False))
+                )
+            yield file_path, metadata
+    finally:
+        conn.commit()
+
+
 def extract_student_repo_from_path(file_path):
     """
     从文件路径提取学生仓库名称
@@ -178,14 +412,59 @@ def extract_student_repo_from_path(file_path):
         return None, None
 
 
+def parse_record_filename(file_path):
+    """
+    解析记录文件名 {workflow}_{run_id}_{sha}.json
+
+    返回 (workflow, run_id, sha)；run_id 无法解析时为 None
+    """
+    name = file_path.rsplit("/", 1)[-1]
+    if name.endswith(".json"):
+        name = name[:-len(".json")]
+    parts = name.split("_")
+    workflow = parts[0]
+    if len(parts) < 3:
+        return workflow, None, None
+    run_id = int(parts[1]) if parts[1].isdigit() else None
+    return workflow, run_id, parts[-1]
+
+
+def record_sort_key(file_path, order):
+    """
+    记录的新旧排序键 (run_id, order)
+
+    以文件名中的 run_id 判断新旧（run_id 单调递增），相同或无法解析时按列表顺序。
+    列表按路径字典序排列（grade_999_* 排在 grade_1000_* 之后），不能只用列表顺序
+    """
+    _, run_id, _ = parse_record_filename(file_path)
+    return (run_id if run_id is not None else -1, order)
+
+
+def select_latest_records(pending):
+    """
+    在下载前为每个 (学生仓库, workflow) 只保留最新的一条记录
+
+    pending 中的排序键由 record_sort_key 生成，返回与 pending 结构相同的 dict
+    """
+    latest = {}  # {(student_repo, workflow): (sort_key, file_path)}
+    for file_path, (sort_key, student_repo, repo_prefix) in pending.items():
+        workflow, _, _ = parse_record_filename(file_path)
+        key = (student_repo, workflow)
+        if key not in latest or sort_key > latest[key][0]:
+            latest[key] = (sort_key, file_path)
+    
+    winners = {file_path for _, file_path in latest.values()}
+    return {file_path: value for file_path, value in pending.items() if file_path in winners}
+
+
 def merge_components(components_list):
     """
     合并多个 metadata 的 components，按 type 去重（保留最新的）
+
+    components_list 需按从旧到新排序，后面的会覆盖前面的
     """
     component_dict = {}  # {type: component}
     
-    # 按时间戳排序（最新的在前）
-    # 这里简化处理，直接按顺序合并，后面的会覆盖前面的
     for components in components_list:
         for comp in components:
             comp_type = comp.get("type", "unknown")
@@ -195,84 +474,35 @@ def merge_components(components_list):
     return list(component_dict.values())
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Collect grades from metadata repository")
-    
-    # Required arguments
-    parser.add_argument("--course", required=True, help="Path to course directory (e.g., courses/CS101)")
-    parser.add_argument("--assignment", required=True, help="Assignment ID (e.g., hw1)")
-    
-    parser.add_argument("--output", default="grades.csv", help="Output CSV file")
-    
-    # Optional/Override arguments
-    parser.add_argument("--metadata-repo", help="Metadata repository (owner/repo) - auto-inferred if not specified")
-    parser.add_argument("--metadata-branch", default=os.getenv("METADATA_BRANCH", "main"),
-                       help="Metadata repository branch")
-    parser.add_argument("--gitea-url", default=os.getenv("GITEA_URL", "http://localhost:3000"))
-    parser.add_argument("--token", default=os.getenv("GITEA_ADMIN_TOKEN", ""))
-    parser.add_argument("--prefix", help="Student repository name prefix (for filtering) - auto-inferred if not specified")
-    
-    args = parser.parse_args()
-    
-    if not args.token:
-        print("Error: GITEA_ADMIN_TOKEN not set", file=sys.stderr)
-        print("Hint: Set it via --token or GITEA_ADMIN_TOKEN environment variable", file=sys.stderr)
-        sys.exit(1)
-    
-    print(f"Collecting grades: {args.course} / {args.assignment}")
-    course_config = load_course_config(args.course)
-    org = course_config.get("organization")
-    if not org:
-        print("Error: 'organization' not defined in course config", file=sys.stderr)
-        sys.exit(1)
-        
-    # Infer metadata repo and prefix
-    # Default to course-metadata, but allow override
-    metadata_repo = args.metadata_repo or f"{org}/course-metadata"
-    repo_prefix = args.prefix or f"{args.assignment}-stu"
+GRADE_FIELDNAMES = ["student_id", "repo", "status", "score", "max_score", "timestamp", "component_summary", "components"]
+OUTPUT_FORMATS = ["csv", "jsonl", "parquet"]
 
-    print(f"📦 Collecting grades from metadata repository: {metadata_repo}")
-    print(f"   Branch: {args.metadata_branch}")
-    print(f"   Gitea URL: {args.gitea_url}")
-    print(f"   Prefix Filter: {repo_prefix}")
-    print(f"   Path: {args.assignment}/")
-    
-    # 列出所有 metadata 文件
-    print("\n🔍 Scanning metadata files...")
-    metadata_files = list_metadata_files(
-        args.gitea_url, 
-        args.token, 
-        metadata_repo,
-        args.metadata_branch,
-        path=args.assignment
+
+def discover_assignments(course_dir):
+    """
+    列出课程下所有作业 ID（assignments/ 下包含 config.yaml 的目录）
+    """
+    assignments_dir = Path(course_dir) / "assignments"
+    if not assignments_dir.is_dir():
+        return []
+    return sorted(
+        d.name for d in assignments_dir.iterdir()
+        if d.is_dir() and not d.name.startswith(".") and (d / "config.yaml").exists()
     )
-    
-    print(f"   Found {len(metadata_files)} metadata files")
-    
-    if len(metadata_files) == 0:
-        print("⚠️  No metadata files found", file=sys.stderr)
-        print(f"   Hint: Check if metadata repository exists and contains files in 'records/' directory", file=sys.stderr)
-        # 创建空 CSV
-        fieldnames = ["student_id", "repo", "status", "score", "max_score", "timestamp", "component_summary", "components"]
-        with open(args.output, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-        print(f"\nEmpty CSV created: {args.output}")
-        return
-    
-    # 按学生分组收集成绩
-    student_grades = defaultdict(lambda: {
-        "student_id": None,
-        "repo": None,
-        "components": [],
-        "timestamps": [],
-        "status": "no_grade"
-    })
-    
-    print("\n📥 Downloading and parsing metadata files...")
-    processed = 0
-    for file_info in metadata_files:
+
+
+def filter_student_files(metadata_files, repo_prefix, path_prefix=""):
+    """
+    过滤出匹配前缀的学生仓库记录
+
+    返回 {file_path: (sort_key, student_repo, repo_prefix)}，
+    sort_key 为 record_sort_key 生成的 (run_id, order)，用于并发下载后按从旧到新合并
+    """
+    pending = {}
+    for order, file_info in enumerate(metadata_files):
         file_path = file_info["path"]
+        if path_prefix and not file_path.startswith(path_prefix):
+            continue
         
         # 提取学生仓库信息
         student_repo, workflow_type = extract_student_repo_from_path(file_path)
@@ -286,58 +516,93 @@ def main():
             if not repo_name.startswith(repo_prefix):
                 continue
         
-        # 下载并解析 metadata
-        metadata = download_metadata_file(
-            args.gitea_url,
-            args.token,
-            metadata_repo,
-            file_path,
-            args.metadata_branch
-        )
-        
-        if not metadata:
-            continue
-        
-        processed += 1
-        
-        # 提取学生信息
-        student_id = metadata.get("student_id")
-        if not student_id:
-            # 从仓库名提取
-            repo_name = student_repo.split("/")[-1] if "/" in student_repo else student_repo
-            if repo_name.startswith(repo_prefix):
-                student_id = repo_name[len(repo_prefix) + 1:]
-            else:
-                student_id = repo_name
-        
-        # 更新学生成绩信息
-        if student_grades[student_repo]["student_id"] is None:
-            student_grades[student_repo]["student_id"] = student_id
-        if student_grades[student_repo]["repo"] is None:
-            student_grades[student_repo]["repo"] = student_repo.split("/")[-1] if "/" in student_repo else student_repo
-        
-        # 合并 components
-        components = metadata.get("components", [])
-        if components:
-            student_grades[student_repo]["components"].append(components)
-        
-        # 记录时间戳
-        timestamp = metadata.get("timestamp")
-        if timestamp:
-            student_grades[student_repo]["timestamps"].append(timestamp)
-        
-        if processed % 10 == 0:
-            print(f"   Processed {processed}/{len(metadata_files)} files...", end="\r")
+        pending[file_path] = (record_sort_key(file_path, order), student_repo, repo_prefix)
+    return pending
+
+
+def load_records(args, client, metadata_repo, mirror_dir, metadata_files, pending):
+    """
+    按所选后端获取 pending 中的记录，yield (file_path, metadata)
+    """
+    if mirror_dir:
+        print("\n📥 Reading metadata files from local mirror...")
+        return read_local_metadata_files(mirror_dir, list(pending))
     
-    print(f"\n   ✅ Processed {processed} metadata files")
+    cache = None
+    cached = {}
+    file_shas = {f["path"]: f.get("sha") for f in metadata_files if f["path"] in pending}
+    if not args.no_cache:
+        cache_path = args.cache or DEFAULT_CACHE_DIR / "records" / f"{metadata_repo.replace('/', '__')}.sqlite"
+        cache = open_record_cache(cache_path)
+        cached = load_cached_records(cache, file_shas)
+        print(f"\n💾 Record cache: {cache_path} ({len(cached)}/{len(pending)} hits)")
     
-    # 生成成绩汇总
-    print("\n📊 Generating grade summary...")
+    to_download = [file_path for file_path in pending if file_path not in cached]
+    print(f"\n📥 Downloading and parsing {len(to_download)} metadata files ({args.workers} workers)...")
+    records = download_metadata_files(
+        client,
+        metadata_repo,
+        to_download,
+        args.metadata_branch,
+        workers=args.workers
+    )
+    if cache:
+        records = iter_cached_and_downloaded(cache, cached, records, file_shas)
+    return records
+
+
+def new_student_grades():
+    """按学生分组收集成绩"""
+    return defaultdict(lambda: {
+        "student_id": None,
+        "repo": None,
+        "components": [],
+        "timestamps": [],
+        "status": "no_grade"
+    })
+
+
+def add_record(student_grades, student_repo, repo_prefix, sort_key, metadata):
+    """将一条 metadata 记录合并到 student_grades"""
+    # 提取学生信息
+    student_id = metadata.get("student_id")
+    if not student_id:
+        # 从仓库名提取
+        repo_name = student_repo.split("/")[-1] if "/" in student_repo else student_repo
+        if repo_name.startswith(repo_prefix):
+            student_id = repo_name[len(repo_prefix) + 1:]
+        else:
+            student_id = repo_name
+    
+    # 更新学生成绩信息
+    if student_grades[student_repo]["student_id"] is None:
+        student_grades[student_repo]["student_id"] = student_id
+    if student_grades[student_repo]["repo"] is None:
+        student_grades[student_repo]["repo"] = student_repo.split("/")[-1] if "/" in student_repo else student_repo
+    
+    # 合并 components
+    components = metadata.get("components", [])
+    if components:
+        student_grades[student_repo]["components"].append((sort_key, components))
+    
+    # 记录时间戳
+    timestamp = metadata.get("timestamp")
+    if timestamp:
+        student_grades[student_repo]["timestamps"].append(timestamp)
+
+
+def build_grade_rows(student_grades):
+    """
+    生成成绩汇总行（每个学生一行，按学号排序）
+
+    每行额外带有 merged_components（合并后的 component 列表），写 CSV 时忽略
+    """
     grades = []
     
     for student_repo, grade_info in student_grades.items():
-        # 合并所有 components
-        all_components = merge_components(grade_info["components"])
+        # 合并所有 components（从旧到新，与下载完成顺序无关）
+        ordered = sorted(grade_info["components"], key=lambda item: item[0])
+        all_components = merge_components([components for _, components in ordered])
         
         if all_components:
             # 计算总分
@@ -380,22 +645,328 @@ def main():
             "max_score": total_max_score,
             "timestamp": latest_timestamp,
             "component_summary": component_summary,
-            "components": json.dumps(all_components, ensure_ascii=False) if all_components else None
+            "components": json.dumps(all_components, ensure_ascii=False) if all_components else None,
+            "merged_components": all_components
         })
     
     # 按学号排序
     grades.sort(key=lambda x: x["student_id"] or "")
-    
-    # 写入 CSV
-    fieldnames = ["student_id", "repo", "status", "score", "max_score", "timestamp", "component_summary", "components"]
-    with open(args.output, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
+    return grades
+
+
+def write_grades_csv(output, grades):
+    """写入单个作业的成绩 CSV"""
+    with open(output, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=GRADE_FIELDNAMES, extrasaction="ignore")
         writer.writeheader()
         if grades:
             writer.writerows(grades)
+
+
+def flatten_grade_rows(grades):
+    """
+    将 components 展开为类型化的列
+
+    每种 component 生成 {type}_score / {type}_max_score 两列
+    （例如 programming_python_score、objective_multiple_choice_score），
+    返回 (fieldnames, rows)
+    """
+    component_types = sorted({
+        comp.get("type", "unknown")
+        for grade in grades
+        for comp in grade["merged_components"]
+    })
+    fieldnames = [f for f in GRADE_FIELDNAMES if f != "components"]
+    for comp_type in component_types:
+        fieldnames += [f"{comp_type}_score", f"{comp_type}_max_score"]
+    
+    rows = []
+    for grade in grades:
+        row = {f: grade.get(f) for f in GRADE_FIELDNAMES if f != "components"}
+        for comp in grade["merged_components"]:
+            comp_type = comp.get("type", "unknown")
+            row[f"{comp_type}_score"] = comp.get("score")
+            row[f"{comp_type}_max_score"] = comp.get("max_score")
+        rows.append(row)
+    return fieldnames, rows
+
+
+def write_jsonl(output, rows):
+    """逐行写入 JSONL"""
+    with open(output, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False))
+            f.write("\n")
+
+
+def write_parquet(output, fieldnames, rows):
+    """
+    写入 Parquet（需要 pyarrow）
+
+    全部为数值的列写为 float64，其余写为 string；
+    没有任何值的列按列名判断（*score 列为 float64）
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("Error: Parquet output requires pyarrow (pip install pyarrow)", file=sys.stderr)
+        sys.exit(1)
+    
+    arrays = []
+    for field in fieldnames:
+        values = [row.get(field) for row in rows]
+        present = [v for v in values if v is not None]
+        if present:
+            numeric = all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present)
+        else:
+            numeric = field.endswith("score")
+        if numeric:
+            arrays.append(pa.array([None if v is None else float(v) for v in values], type=pa.float64()))
+        else:
+            arrays.append(pa.array([None if v is None else str(v) for v in values], type=pa.string()))
+    
+    pq.write_table(pa.Table.from_arrays(arrays, names=fieldnames), output)
+
+
+def write_grades(output, grades, fmt="csv"):
+    """按格式写入单个作业的成绩"""
+    if fmt == "jsonl":
+        # components 保留为结构化列表，无需再解析字符串
+        write_jsonl(output, (
+            {**{f: grade.get(f) for f in GRADE_FIELDNAMES}, "components": grade.get("merged_components") or []}
+            for grade in grades
+        ))
+    elif fmt == "parquet":
+        fieldnames, rows = flatten_grade_rows(grades)
+        write_parquet(output, fieldnames, rows)
+    else:
+        write_grades_csv(output, grades)
+
+
+def write_gradebook(output, fieldnames, rows, fmt="csv"):
+    """按格式写入课程成绩总表"""
+    if fmt == "jsonl":
+        write_jsonl(output, rows)
+    elif fmt == "parquet":
+        write_parquet(output, fieldnames, rows)
+    else:
+        with open(output, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def build_gradebook(grades_by_assignment):
+    """
+    将多个作业的成绩合并为一张宽表（每个学生一行）
+
+    列：student_id, 每个作业的 {assignment}_score / {assignment}_max_score /
+    {assignment}_{component_type}，以及 total_score / total_max_score
+    返回 (fieldnames, rows)
+    """
+    fieldnames = ["student_id"]
+    rows = {}
+    
+    for assignment, grades in grades_by_assignment.items():
+        component_types = sorted({
+            comp.get("type", "unknown")
+            for grade in grades
+            for comp in grade["merged_components"]
+        })
+        fieldnames += [f"{assignment}_score", f"{assignment}_max_score"]
+        fieldnames += [f"{assignment}_{comp_type}" for comp_type in component_types]
+        
+        for grade in grades:
+            row = rows.setdefault(grade["student_id"], {"student_id": grade["student_id"]})
+            row[f"{assignment}_score"] = grade["score"]
+            row[f"{assignment}_max_score"] = grade["max_score"]
+            for comp in grade["merged_components"]:
+                row[f"{assignment}_{comp.get('type', 'unknown')}"] = comp.get("score", 0)
+    
+    fieldnames += ["total_score", "total_max_score"]
+    for row in rows.values():
+        row["total_score"] = sum(row.get(f"{a}_score") or 0 for a in grades_by_assignment)
+        row["total_max_score"] = sum(row.get(f"{a}_max_score") or 0 for a in grades_by_assignment)
+    
+    return fieldnames, sorted(rows.values(), key=lambda r: r["student_id"] or "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect grades from metadata repository")
+    
+    # Required arguments
+    parser.add_argument("--course", required=True, help="Path to course directory (e.g., courses/CS101)")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--assignment", help="Assignment ID (e.g., hw1)")
+    target.add_argument("--all-assignments", action="store_true",
+                        help="Collect every assignment under {course}/assignments/ into one gradebook")
+    
+    parser.add_argument("--output", help="Output file (default: grades.{format}, or gradebook.{format} with --all-assignments)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="csv",
+                       help="Output format: csv, jsonl (one JSON object per line) or parquet (requires pyarrow)")
+    
+    # Optional/Override arguments
+    parser.add_argument("--metadata-repo", help="Metadata repository (owner/repo) - auto-inferred if not specified")
+    parser.add_argument("--metadata-branch", default=os.getenv("METADATA_BRANCH", "main"),
+                       help="Metadata repository branch")
+    parser.add_argument("--gitea-url", default=os.getenv("GITEA_URL", "http://localhost:3000"))
+    parser.add_argument("--token", default=os.getenv("GITEA_ADMIN_TOKEN", ""))
+    parser.add_argument("--prefix", help="Student repository name prefix (for filtering) - auto-inferred if not specified")
+    parser.add_argument("--backend", choices=["api", "git"], default=os.getenv("COLLECT_BACKEND", "api"),
+                       help="How to read the metadata repository: Gitea contents API or a local git mirror")
+    parser.add_argument("--mirror-dir",
+                       help="Local mirror directory for --backend git (default: ~/.cache/gitea-autograde/metadata/{owner}/{repo})")
+    parser.add_argument("--all-records", action="store_true",
+                       help="Download every historical record instead of only the latest per student and workflow")
+    parser.add_argument("--cache",
+                       help="Local record cache for --backend api (default: ~/.cache/gitea-autograde/records/{owner}__{repo}.sqlite)")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the local record cache")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("COLLECT_WORKERS", "8")),
+                       help="Number of concurrent download workers")
+    parser.add_argument("--max-connections", type=int,
+                       help="Max concurrent connections to the Gitea host (default: same as --workers)")
+    
+    args = parser.parse_args()
+    
+    if args.all_assignments and args.prefix:
+        parser.error("--prefix cannot be used with --all-assignments (each assignment uses {assignment}-stu)")
+    
+    if not args.token:
+        print("Error: GITEA_ADMIN_TOKEN not set", file=sys.stderr)
+        print("Hint: Set it via --token or GITEA_ADMIN_TOKEN environment variable", file=sys.stderr)
+        sys.exit(1)
+    
+    if args.all_assignments:
+        assignments = discover_assignments(args.course)
+        if not assignments:
+            print(f"Error: No assignments found in {Path(args.course) / 'assignments'}", file=sys.stderr)
+            sys.exit(1)
+        output = args.output or f"gradebook.{args.format}"
+        list_path = ""
+    else:
+        assignments = [args.assignment]
+        output = args.output or f"grades.{args.format}"
+        list_path = args.assignment
+    
+    print(f"Collecting grades: {args.course} / {', '.join(assignments)}")
+    course_config = load_course_config(args.course)
+    org = course_config.get("organization")
+    if not org:
+        print("Error: 'organization' not defined in course config", file=sys.stderr)
+        sys.exit(1)
+        
+    # Infer metadata repo and prefix
+    # Default to course-metadata, but allow override
+    metadata_repo = args.metadata_repo or f"{org}/course-metadata"
+    if args.all_assignments:
+        repo_prefixes = {assignment: f"{assignment}-stu" for assignment in assignments}
+    else:
+        repo_prefixes = {args.assignment: args.prefix or f"{args.assignment}-stu"}
+
+    print(f"📦 Collecting grades from metadata repository: {metadata_repo}")
+    print(f"   Branch: {args.metadata_branch}")
+    print(f"   Gitea URL: {args.gitea_url}")
+    print(f"   Prefix Filter: {', '.join(repo_prefixes.values())}")
+    print(f"   Path: {list_path}/")
+    print(f"   Backend: {args.backend}")
+    
+    # 检测主机地址
+    host = detect_host(args.gitea_url, os.getenv("EXTERNAL_GITEA_HOST"))
+    client = GiteaClient(f"http://{host}", args.token, pool_size=args.max_connections or args.workers)
+    
+    mirror_dir = None
+    if args.backend == "git":
+        print("\n🔄 Syncing local metadata mirror...")
+        mirror_dir = sync_metadata_mirror(
+            client,
+            metadata_repo,
+            args.metadata_branch,
+            args.mirror_dir
+        )
+        if mirror_dir is None:
+            sys.exit(1)
+        print(f"   Mirror: {mirror_dir}")
+    
+    # 列出所有 metadata 文件（--all-assignments 时整个仓库只列一次）
+    print("\n🔍 Scanning metadata files...")
+    if mirror_dir:
+        metadata_files = list_local_metadata_files(mirror_dir, list_path)
+    else:
+        metadata_files = list_metadata_files(
+            client,
+            metadata_repo,
+            args.metadata_branch,
+            path=list_path
+        )
+    
+    print(f"   Found {len(metadata_files)} metadata files")
+    
+    if len(metadata_files) == 0:
+        print("⚠️  No metadata files found", file=sys.stderr)
+        print(f"   Hint: Check if metadata repository exists and contains files in '{list_path}/' directory", file=sys.stderr)
+        # 创建空输出文件
+        if args.all_assignments:
+            fieldnames, rows = build_gradebook({assignment: [] for assignment in assignments})
+            write_gradebook(output, fieldnames, rows, args.format)
+        else:
+            write_grades(output, [], args.format)
+        print(f"\nEmpty {args.format.upper()} created: {output}")
+        return
+    
+    # 按作业分别过滤学生记录
+    pending = {}  # {file_path: ((run_id, order), student_repo, repo_prefix)}
+    assignment_of = {}  # {file_path: assignment}
+    for assignment, repo_prefix in repo_prefixes.items():
+        path_prefix = f"{assignment}/" if args.all_assignments else ""
+        matched = filter_student_files(metadata_files, repo_prefix, path_prefix)
+        pending.update(matched)
+        assignment_of.update((file_path, assignment) for file_path in matched)
+    
+    # 每个 (学生, workflow) 只下载最新的记录
+    if not args.all_records:
+        total_records = len(pending)
+        pending = select_latest_records(pending)
+        print(f"   Selected {len(pending)} latest records (of {total_records})")
+    
+    student_grades_by_assignment = {assignment: new_student_grades() for assignment in assignments}
+    records = load_records(args, client, metadata_repo, mirror_dir, metadata_files, pending)
+    
+    processed = 0
+    # 解析 metadata（完成一个处理一个）
+    for file_path, metadata in records:
+        if not metadata:
+            continue
+        
+        processed += 1
+        sort_key, student_repo, repo_prefix = pending[file_path]
+        add_record(student_grades_by_assignment[assignment_of[file_path]], student_repo, repo_prefix, sort_key, metadata)
+        
+        if processed % 10 == 0:
+            print(f"   Processed {processed}/{len(pending)} files...", end="\r")
+    
+    print(f"\n   ✅ Processed {processed} metadata files")
+    
+    # 生成成绩汇总
+    grades_by_assignment = {}
+    for assignment, student_grades in student_grades_by_assignment.items():
+        print(f"\n📊 Generating grade summary ({assignment})...")
+        grades_by_assignment[assignment] = build_grade_rows(student_grades)
+    
+    if args.all_assignments:
+        fieldnames, rows = build_gradebook(grades_by_assignment)
+        write_gradebook(output, fieldnames, rows, args.format)
+        
+        print(f"\n✅ Gradebook saved to {output}")
+        print(f"   Assignments: {len(assignments)}")
+        print(f"   Total students: {len(rows)}")
+        return
+    
+    grades = grades_by_assignment[args.assignment]
+    write_grades(output, grades, args.format)
     
     graded_count = sum(1 for g in grades if g["status"] == "graded")
-    print(f"\n✅ Grades saved to {args.output}")
+    print(f"\n✅ Grades saved to {output}")
     print(f"   Total students: {len(grades)}")
     print(f"   Graded: {graded_count}")
     print(f"   Not graded: {len(grades) - graded_count}")
@@ -12,21 +12,21 @@ import sys
 import argparse
 import requests
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+from gitea_client import GiteaClient
 
 load_dotenv()
 
 
-def create_user(gitea_url, token, username, password, email=None, full_name=None):
+def create_user(client, username, password, email=None, full_name=None):
     """
     创建 Gitea 用户
     
     Parameters
     ----------
-    gitea_url : str
-        Gitea 服务器 URL
-    token : str
-        Gitea 管理员 Token
+    client : GiteaClient
+        使用管理员 Token 的 Gitea 客户端
     username : str
         用户名
     password : str
@@ -46,13 +46,6 @@ def create_user(gitea_url, token, username, password, email=None, full_name=None
     if not full_name:
         full_name = username
     
-    api_url = f"{gitea_url}/api/v1/admin/users"
-    
-    headers = {
-        "Authorization": f"token {token}",
-        "Content-Type": "application/json"
-    }
-    
     data = {
         "username": username,
         "email": email,
@@ -64,7 +57,7 @@ def create_user(gitea_url, token, username, password, email=None, full_name=None
     }
     
     try:
-        response = requests.post(api_url, headers=headers, json=data, timeout=30)
+        response = client.post("/admin/users", json=data)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.HTTPError as e:
@@ -88,6 +81,19 @@ def create_user(gitea_url, token, username, password, email=None, full_name=None
         return None
 
 
+def list_existing_usernames(client):
+    """
+    通过分页的管理员用户列表一次性获取所有已存在的用户名
+
+    返回小写用户名集合（Gitea 用户名不区分大小写）；失败时返回 None
+    """
+    try:
+        return {user["login"].lower() for user in client.paginate("/admin/users", limit=50)}
+    except Exception as e:
+        print(f"Warning: Failed to list existing users: {e}", file=sys.stderr)
+        return None
+
+
 def read_student_list(file_path):
     """
     从文件读取学生列表
@@ -164,6 +170,8 @@ def main():
     parser.add_argument("--output", help="账号信息输出文件路径 (默认: user_accounts.txt)")
     parser.add_argument("--dry-run", action="store_true", help="试运行模式，不实际创建用户")
     parser.add_argument("--skip-existing", action="store_true", help="跳过已存在的用户")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("CREATE_USERS_WORKERS", "4")),
+                        help="并发创建的用户数 (1 = 串行)")
     parser.add_argument("--gitea-url", default=os.getenv("GITEA_URL", "http://localhost:3000"))
     parser.add_argument("--token", default=os.getenv("GITEA_ADMIN_TOKEN", ""))
     
@@ -203,37 +211,63 @@ def main():
     print(f"   密码: {args.password}")
     print()
     
+    workers = max(1, args.workers)
+    client = GiteaClient(args.gitea_url, args.token, pool_size=workers)
+    
+    # 一次性获取已存在的用户，本地跳过，避免每个已存在用户都产生一次 422 请求
+    print(f"🔍 获取已存在的用户...")
+    existing = list_existing_usernames(client)
+    if existing is None:
+        existing = set()
+        print("   获取失败，将逐个创建并根据返回结果判断")
+    else:
+        print(f"   Gitea 中已有 {len(existing)} 个用户")
+    print()
+    
     success_count = 0
     skip_count = 0
     fail_count = 0
     
+    pending = []
     for username, email, full_name in students:
-        display_email = email if email else f"{username}@example.com"
-        print(f"创建用户 {username} ({display_email})... ", end="", flush=True)
-        
-        result = create_user(
-            args.gitea_url, 
-            args.token, 
-            username, 
-            args.password, 
-            email, 
-            full_name
-        )
-        
-        if result is None:
-            fail_count += 1
-            print("❌ 失败")
-        elif isinstance(result, dict) and result.get("error") == "user_exists":
+        if username.lower() in existing:
             if args.skip_existing:
                 skip_count += 1
-                print("⏭️  已存在（跳过）")
+                print(f"⏭️  {username} 已存在（跳过）")
             else:
                 fail_count += 1
-                print("❌ 用户已存在")
+                print(f"❌ {username} 用户已存在")
         else:
-            success_count += 1
-            user_id = result.get("id", "?")
-            print(f"✅ 成功 (ID: {user_id})")
+            pending.append((username, email, full_name))
+    
+    if pending:
+        print(f"👥 创建 {len(pending)} 个用户（{workers} 个并发）...")
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(create_user, client, username, args.password, email, full_name): (username, email)
+            for username, email, full_name in pending
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            username, email = futures[future]
+            display_email = email if email else f"{username}@gitea.local"
+            result = future.result()
+            prefix = f"[{done}/{len(pending)}] {username} ({display_email})"
+            
+            if result is None:
+                fail_count += 1
+                print(f"{prefix}: ❌ 失败")
+            elif isinstance(result, dict) and result.get("error") == "user_exists":
+                if args.skip_existing:
+                    skip_count += 1
+                    print(f"{prefix}: ⏭️  已存在（跳过）")
+                else:
+                    fail_count += 1
+                    print(f"{prefix}: ❌ 用户已存在")
+            else:
+                success_count += 1
+                user_id = result.get("id", "?")
+                print(f"{prefix}: ✅ 成功 (ID: {user_id})")
     
     print()
     print(f"✅ 完成！")
@@ -9,69 +9,40 @@
 
 import os
 import sys
+import time
 import argparse
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+from gitea_client import GiteaClient
+from repo_cache import OrgRepoIndex
 
 load_dotenv()
 
 
-def list_repos(gitea_url, token, org, prefix):
+def list_repos(client, org, prefix, index=None, refresh=True):
     """
     列出组织下所有匹配前缀的仓库
+
+    prefix 可以是单个前缀或前缀列表，多个前缀共用一次组织仓库列表；
+    列表来自组织仓库索引缓存 (repo_cache.OrgRepoIndex)。删除不可逆，
+    默认忽略缓存有效期，每次都按 ETag 重新验证（未变化的页只需 304 响应）
     """
-    api_url = f"{gitea_url}/api/v1/orgs/{org}/repos"
-    
-    headers = {
-        "Authorization": f"token {token}",
-        "Content-Type": "application/json"
-    }
-    
-    params = {
-        "limit": 100,
-        "page": 1
-    }
-    
-    all_repos = []
-    
-    while True:
-        try:
-            response = requests.get(api_url, headers=headers, params=params, timeout=30)
-            response.raise_for_status()
-            
-            repos = response.json()
-            if not repos:
-                break
-            
-            # 过滤匹配前缀的仓库
-            matching_repos = [r for r in repos if r["name"].startswith(prefix)]
-            all_repos.extend(matching_repos)
-            
-            params["page"] += 1
-            
-            # 如果返回数量少于 limit，说明已经是最后一页
-            if len(repos) < params["limit"]:
-                break
-                
-        except requests.exceptions.RequestException as e:
-            print(f"Error listing repositories: {e}", file=sys.stderr)
-            return []
-    
-    return all_repos
+    if index is None:
+        index = OrgRepoIndex(client, org)
+    try:
+        return index.with_prefix(prefix, refresh=refresh)
+    except requests.exceptions.RequestException as e:
+        print(f"Error listing repositories: {e}", file=sys.stderr)
+        return []
 
 
-def delete_repo(gitea_url, token, org, repo_name):
+def delete_repo(client, org, repo_name):
     """
     删除指定仓库
     """
-    api_url = f"{gitea_url}/api/v1/repos/{org}/{repo_name}"
-    
-    headers = {
-        "Authorization": f"token {token}"
-    }
-    
     try:
-        response = requests.delete(api_url, headers=headers, timeout=30)
+        response = client.delete(f"/repos/{org}/{repo_name}")
         response.raise_for_status()
         return True
     except requests.exceptions.HTTPError as e:
@@ -92,18 +63,24 @@ def main():
   python scripts/delete_repos.py --course courses/CS101 --assignment hw1
   python scripts/delete_repos.py --course courses/CS101 --assignment hw1 --force
   python scripts/delete_repos.py --course courses/CS101 --assignment hw1 --dry-run
+  
+  # 学期末一次清理多个作业
+  python scripts/delete_repos.py --course courses/CS101 --assignment hw1 --assignment hw2 --workers 8
         """
     )
     
     # Required arguments
     parser.add_argument("--course", required=True, help="课程路径 (例如: courses/CS101)")
-    parser.add_argument("--assignment", required=True, help="作业ID (例如: hw1)")
+    parser.add_argument("--assignment", required=True, action="append",
+                        help="作业ID (例如: hw1)，可重复指定多个作业")
     
     # Optional arguments
     parser.add_argument("--gitea-url", default=os.getenv("GITEA_URL", "http://localhost:3000"))
     parser.add_argument("--token", default=os.getenv("GITEA_ADMIN_TOKEN", ""))
     parser.add_argument("--force", action="store_true", help="跳过确认提示")
     parser.add_argument("--dry-run", action="store_true", help="试运行模式（不实际删除）")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("DELETE_WORKERS", "4")),
+                        help="并发删除的仓库数 (1 = 串行)")
     
     args = parser.parse_args()
     
@@ -126,16 +103,20 @@ def main():
         print(f"Error loading course config: {e}", file=sys.stderr)
         sys.exit(1)
     
-    prefix = f"{args.assignment}-stu"
+    prefixes = [f"{assignment}-stu" for assignment in dict.fromkeys(args.assignment)]
     
     print(f"🔍 正在查找仓库...")
     print(f"   Gitea: {args.gitea_url}")
     print(f"   组织: {org}")
-    print(f"   前缀: {prefix}")
+    print(f"   前缀: {', '.join(prefixes)}")
     print()
     
-    # 获取仓库列表
-    repos = list_repos(args.gitea_url, args.token, org, prefix)
+    workers = max(1, args.workers)
+    client = GiteaClient(args.gitea_url, args.token, pool_size=workers)
+    
+    # 获取仓库列表（所有前缀共用一次组织仓库列表）
+    index = OrgRepoIndex(client, org)
+    repos = list_repos(client, org, prefixes, index=index)
     
     if not repos:
         print("✅ 没有找到匹配的仓库")
@@ -143,9 +124,13 @@ def main():
     
     # 显示找到的仓库
     print(f"📋 找到以下仓库：")
-    for repo in repos:
-        private_flag = "🔒" if repo["private"] else "🌐"
-        print(f"   {private_flag} {repo['name']}")
+    for prefix in prefixes:
+        matched = [repo for repo in repos if repo["name"].startswith(prefix)]
+        if len(prefixes) > 1:
+            print(f"   [{prefix}] {len(matched)} 个")
+        for repo in matched:
+            private_flag = "🔒" if repo["private"] else "🌐"
+            print(f"   {private_flag} {repo['name']}")
     
     print()
     print(f"📊 共 {len(repos)} 个仓库")
@@ -172,25 +157,36 @@ def main():
         return
     
     print()
-    print("🗑️  开始删除...")
+    print(f"🗑️  开始删除（{workers} 个并发）...")
     print()
     
     success_count = 0
     fail_count = 0
+    deleted = []
+    started = time.monotonic()
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(delete_repo, client, org, repo["name"]): repo["name"] for repo in repos}
+        for done, future in enumerate(as_completed(futures), 1):
+            repo_name = futures[future]
+            if future.result():
+                success_count += 1
+                deleted.append(repo_name)
+                status = "✅ 成功"
+            else:
+                fail_count += 1
+                status = "❌ 失败"
+            
+            elapsed = time.monotonic() - started
+            eta = elapsed / done * (len(repos) - done)
+            print(f"[{done}/{len(repos)} {done * 100 // len(repos)}% ETA {eta:.0f}s] 删除 {repo_name}: {status}",
+                  flush=True)
     
-    for repo in repos:
-        repo_name = repo["name"]
-        print(f"删除 {repo_name}... ", end="", flush=True)
-        
-        if delete_repo(args.gitea_url, args.token, org, repo_name):
-            success_count += 1
-            print("✅ 成功")
-        else:
-            fail_count += 1
-            print("❌ 失败")
+    # 同步更新组织仓库索引缓存
+    index.remove(deleted)
     
     print()
-    print(f"✅ 完成！成功: {success_count}, 失败: {fail_count}")
+    print(f"✅ 完成！成功: {success_count}, 失败: {fail_count} (耗时 {time.monotonic() - started:.1f}s)")
     
     if fail_count > 0:
         print()
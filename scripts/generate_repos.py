@@ -7,14 +7,24 @@
 """
 
 import os
+import re
 import sys
 import argparse
 import requests
 import yaml
 import subprocess
 import shutil
+import csv
+import json
+import time
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from dotenv import load_dotenv
+from gitea_client import GiteaClient
+from repo_cache import DEFAULT_CACHE_DIR, OrgRepoIndex
+from sync_autograde import copy_answer_templates
 
 load_dotenv()
 
@@ -32,35 +42,51 @@ def load_assignment_config(course_dir, assignment_id):
     with open(config_path, 'r') as f:
         return yaml.safe_load(f)
 
-def run_git_cmd(cmd, cwd=None):
+def run_git_cmd(args, cwd=None, check=True):
+    """运行 git 命令（参数列表，不经过 shell），返回 CompletedProcess"""
     try:
-        subprocess.run(cmd, check=True, cwd=cwd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return subprocess.run(args, check=check, cwd=cwd, capture_output=True, text=True)
     except subprocess.CalledProcessError as e:
-        print(f"Git command failed: {e.cmd}\nStderr: {e.stderr.decode()}", file=sys.stderr)
+        # 隐藏 remote URL 中的 Token
+        cmd = re.sub(r"://[^/@\s]+@", "://***@", " ".join(e.cmd))
+        print(f"Git command failed: {cmd}\nStderr: {e.stderr}", file=sys.stderr)
         raise
 
-def ensure_org_exists(gitea_url, token, org_name):
+def wait_for_branch_commit(client, org, repo_name, branch, sha, timeout=60):
+    """
+    轮询分支 API，直到 Gitea 上分支指向刚推送的提交
+
+    指数退避（0.25s 起，最长 4s），超过 timeout 秒仍不可见时返回 False
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.25
+    while True:
+        resp = client.get(f"/repos/{org}/{repo_name}/branches/{branch}")
+        if resp.status_code == 200 and resp.json().get("commit", {}).get("id") == sha:
+            return True
+        if time.monotonic() + delay > deadline:
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, 4)
+
+def ensure_org_exists(client, org_name):
     """
     确保 Gitea 组织存在。如果不存在则创建。
     """
-    api_url = f"{gitea_url}/api/v1/orgs/{org_name}"
-    headers = {"Authorization": f"token {token}"}
-    
     # 检查组织是否存在
-    resp = requests.get(api_url, headers=headers)
+    resp = client.get(f"/orgs/{org_name}")
     if resp.status_code == 200:
         print(f"Organization {org_name} already exists.")
         return True
     
     # 创建组织
     print(f"Creating organization {org_name}...")
-    create_url = f"{gitea_url}/api/v1/orgs"
     data = {
         "username": org_name,
         "visibility": "public",
         "repo_admin_change_team_access": True
     }
-    resp = requests.post(create_url, headers=headers, json=data)
+    resp = client.post("/orgs", json=data)
     if resp.status_code == 201:
         print(f"✓ Organization {org_name} created successfully.")
         return True
@@ -68,38 +94,37 @@ def ensure_org_exists(gitea_url, token, org_name):
         print(f"Failed to create organization: {resp.text}", file=sys.stderr)
         return False
 
-def ensure_repo_exists(gitea_url, token, org, repo_name, source_dir, is_private=False, is_template=False):
+def ensure_repo_exists(client, org, repo_name, source_dir, is_private=False, is_template=False, index=None):
     """
     确保仓库存在。如果不存在，创建并推送 source_dir 的内容。
+
+    始终请求仓库 API 确认是否存在（缓存的列表可能已过期，仓库可能在缓存有效期内被删除）；
+    提供 index (repo_cache.OrgRepoIndex) 时，新创建的仓库会写入缓存。
     """
-    api_url = f"{gitea_url}/api/v1/repos/{org}/{repo_name}"
-    headers = {"Authorization": f"token {token}"}
-    
     # Check if repo exists
-    resp = requests.get(api_url, headers=headers)
-    if resp.status_code == 200:
+    if client.get(f"/repos/{org}/{repo_name}").status_code == 200:
         print(f"Repository {org}/{repo_name} already exists.")
         # Update template setting if needed
         if is_template:
-            patch_url = f"{gitea_url}/api/v1/repos/{org}/{repo_name}"
             patch_data = {"template": True}
-            requests.patch(patch_url, headers=headers, json=patch_data)
+            client.patch(f"/repos/{org}/{repo_name}", json=patch_data)
             print(f"✓ Marked {repo_name} as template repository.")
         return True
     
     print(f"Creating repository {org}/{repo_name}...")
     # Create repo
-    create_url = f"{gitea_url}/api/v1/orgs/{org}/repos"
     data = {
         "name": repo_name,
         "private": is_private,
         "template": is_template,
         "auto_init": False
     }
-    resp = requests.post(create_url, headers=headers, json=data)
+    resp = client.post(f"/orgs/{org}/repos", json=data)
     if resp.status_code != 201:
         print(f"Failed to create repo: {resp.text}", file=sys.stderr)
         return False
+    if index is not None:
+        index.add(resp.json())
     
     # Push content
     if source_dir and Path(source_dir).exists():
@@ -115,6 +140,7 @@ def ensure_repo_exists(gitea_url, token, org, repo_name, source_dir, is_private=
                 print(f"  Copying autograde scripts to {autograde_dest}...")
                 autograde_dest.mkdir(parents=True, exist_ok=True)
                 shutil.copytree(autograde_source, autograde_dest, dirs_exist_ok=True)
+                copy_answer_templates(source_dir, autograde_dest)
                 print(f"  ✅ Autograde scripts copied")
             else:
                 print(f"  ⚠️  Warning: Autograde scripts not found at {autograde_source}")
@@ -123,43 +149,42 @@ def ensure_repo_exists(gitea_url, token, org, repo_name, source_dir, is_private=
         git_dir = Path(source_dir) / ".git"
         if git_dir.exists():
              # If it's already a git repo, we need to commit the new autograde files
-             run_git_cmd("git add .autograde", cwd=source_dir)
-             run_git_cmd("git commit -m 'Add autograde scripts' || true", cwd=source_dir)
+             if is_template:
+                 run_git_cmd(["git", "add", ".autograde"], cwd=source_dir)
+             run_git_cmd(["git", "commit", "-m", "Add autograde scripts"], cwd=source_dir, check=False)
         else:
-            run_git_cmd("git init", cwd=source_dir)
-            run_git_cmd("git add .", cwd=source_dir)
-            run_git_cmd("git commit -m 'Initial commit'", cwd=source_dir)
+            run_git_cmd(["git", "init"], cwd=source_dir)
+            run_git_cmd(["git", "add", "."], cwd=source_dir)
+            run_git_cmd(["git", "commit", "-m", "Initial commit"], cwd=source_dir)
             
         # Add remote and push
-        remote_url = f"{gitea_url}/{org}/{repo_name}.git"
+        remote_url = f"{client.base_url}/{org}/{repo_name}.git"
         # Insert token for auth
-        auth_remote_url = remote_url.replace("://", f"://{token}@")
+        auth_remote_url = remote_url.replace("://", f"://{client.token}@")
         
-        try:
-            run_git_cmd(f"git remote add origin {auth_remote_url}", cwd=source_dir)
-        except:
-            run_git_cmd(f"git remote set-url origin {auth_remote_url}", cwd=source_dir)
+        if run_git_cmd(["git", "remote", "add", "origin", auth_remote_url], cwd=source_dir, check=False).returncode != 0:
+            run_git_cmd(["git", "remote", "set-url", "origin", auth_remote_url], cwd=source_dir)
             
-        run_git_cmd("git branch -M main", cwd=source_dir)
-        run_git_cmd("git push -u origin main", cwd=source_dir)
+        run_git_cmd(["git", "branch", "-M", "main"], cwd=source_dir)
+        run_git_cmd(["git", "push", "-u", "origin", "main"], cwd=source_dir)
         print("Content pushed successfully.")
-        import time
-        print("Waiting 5 seconds for Gitea to process the push...")
-        time.sleep(5)
+        
+        # 等待 Gitea 处理完推送（分支指向刚推送的提交）后再继续
+        head_sha = run_git_cmd(["git", "rev-parse", "HEAD"], cwd=source_dir).stdout.strip()
+        started = time.monotonic()
+        if wait_for_branch_commit(client, org, repo_name, "main", head_sha):
+            print(f"✓ {repo_name} is ready ({time.monotonic() - started:.1f}s).")
+        else:
+            print(f"Warning: pushed commit of {repo_name} not visible yet, continuing anyway", file=sys.stderr)
         
     return True
 
-def generate_student_repo(gitea_url, token, org, template_repo, student_login, repo_name):
+def generate_student_repo(client, org, template_repo, student_login, repo_name):
     """
     从模板生成学生作业仓库
+
+    仓库已存在（409）时返回 {"name": repo_name, "already_exists": True}
     """
-    api_url = f"{gitea_url}/api/v1/repos/{org}/{template_repo}/generate"
-    
-    headers = {
-        "Authorization": f"token {token}",
-        "Content-Type": "application/json"
-    }
-    
     data = {
         "owner": org,
         "name": repo_name,
@@ -174,34 +199,27 @@ def generate_student_repo(gitea_url, token, org, template_repo, student_login, r
     }
     
     try:
-        response = requests.post(api_url, headers=headers, json=data, timeout=30)
+        response = client.post(f"/repos/{org}/{template_repo}/generate", json=data)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.HTTPError as e:
-        print(f"Error generating repo {repo_name}: {e}", file=sys.stderr)
         if response.status_code == 409:
-            print(f"  Repository {repo_name} already exists", file=sys.stderr)
+            return {"name": repo_name, "already_exists": True}
+        print(f"Error generating repo {repo_name}: {e}", file=sys.stderr)
         return None
     except Exception as e:
         print(f"Error generating repo {repo_name}: {e}", file=sys.stderr)
         return None
 
 
-def add_collaborator(gitea_url, token, org, repo_name, student_login, permission="write"):
+def add_collaborator(client, org, repo_name, student_login, permission="write"):
     """
     添加学生为仓库协作者
     """
-    api_url = f"{gitea_url}/api/v1/repos/{org}/{repo_name}/collaborators/{student_login}"
-    
-    headers = {
-        "Authorization": f"token {token}",
-        "Content-Type": "application/json"
-    }
-    
     data = {"permission": permission}
     
     try:
-        response = requests.put(api_url, headers=headers, json=data, timeout=30)
+        response = client.put(f"/repos/{org}/{repo_name}/collaborators/{student_login}", json=data)
         response.raise_for_status()
         return True
     except requests.exceptions.HTTPError as e:
@@ -227,6 +245,137 @@ def read_student_list(file_path):
     return students
 
 
+def list_org_repo_names(client, org, index=None):
+    """
+    列出组织下所有仓库名称（忽略缓存有效期，重新验证组织仓库索引）；失败时返回 None
+    """
+    if index is None:
+        index = OrgRepoIndex(client, org)
+    try:
+        return index.names(refresh=True)
+    except Exception as e:
+        print(f"Error listing repositories of {org}: {e}", file=sys.stderr)
+        return None
+
+
+class ProvisionJournal:
+    """
+    学生仓库创建进度日志（JSON 文件）
+
+    记录每个学生仓库是否已创建、协作者是否已添加，重复运行时只做剩余的工作。
+    每次更新后立即原子写回磁盘，中途中断也不会丢失已完成的进度。
+    """
+    
+    def __init__(self, path, org, assignment):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.data = {"org": org, "assignment": assignment, "students": {}}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+            self.data.setdefault("students", {})
+    
+    def get(self, repo_name):
+        with self.lock:
+            return dict(self.data["students"].get(repo_name, {}))
+    
+    def update(self, repo_name, login, **fields):
+        with self.lock:
+            entry = self.data["students"].setdefault(repo_name, {
+                "login": login,
+                "repo_created": False,
+                "collaborator_added": False
+            })
+            entry.update(fields)
+            entry["updated_at"] = datetime.now().isoformat(timespec="seconds")
+            self._save()
+    
+    def reconcile(self, existing_repos, tasks):
+        """按组织中实际存在的仓库校正 repo_created 状态，返回 (新确认数, 已丢失数)"""
+        found = missing = 0
+        with self.lock:
+            for repo_name, login in tasks:
+                entry = self.data["students"].get(repo_name)
+                exists = repo_name in existing_repos
+                if exists and not (entry and entry.get("repo_created")):
+                    entry = self.data["students"].setdefault(repo_name, {
+                        "login": login,
+                        "repo_created": False,
+                        "collaborator_added": False
+                    })
+                    entry["repo_created"] = True
+                    found += 1
+                elif not exists and entry and entry.get("repo_created"):
+                    # 仓库已被删除，需要重新创建并重新添加协作者
+                    entry["repo_created"] = False
+                    entry["collaborator_added"] = False
+                    missing += 1
+            self._save()
+        return found, missing
+    
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def provision_student(client, org, template_repo, repo_name, login, skip_collaborator=False, journal=None):
+    """
+    为单个学生创建仓库并添加协作者
+
+    提供 journal 时跳过已完成的步骤，并在每一步完成后记录进度。
+    返回结果 dict: login, repo, repo_status, collaborator_status, ok, elapsed
+    """
+    started = time.monotonic()
+    result = {
+        "login": login,
+        "repo": repo_name,
+        "repo_status": "failed",
+        "collaborator_status": "-",
+        "ok": False
+    }
+    entry = journal.get(repo_name) if journal else {}
+    
+    if entry.get("repo_created"):
+        result["repo_status"] = "done"
+    else:
+        repo_data = generate_student_repo(client, org, template_repo, login, repo_name)
+        if repo_data is not None:
+            result["repo_status"] = "exists" if repo_data.get("already_exists") else "created"
+            if journal:
+                journal.update(repo_name, login, repo_created=True)
+    
+    if result["repo_status"] != "failed":
+        result["ok"] = True
+        if skip_collaborator:
+            result["collaborator_status"] = "skipped"
+        elif entry.get("collaborator_added"):
+            result["collaborator_status"] = "done"
+        elif add_collaborator(client, org, repo_name, login):
+            result["collaborator_status"] = "added"
+            if journal:
+                journal.update(repo_name, login, collaborator_added=True)
+        else:
+            result["collaborator_status"] = "failed"
+    
+    result["elapsed"] = round(time.monotonic() - started, 2)
+    return result
+
+
+def print_result_table(results):
+    """打印每个学生的处理结果"""
+    if not results:
+        return
+    headers = ["login", "repo", "repo_status", "collaborator_status", "elapsed"]
+    widths = [max([len(h), *(len(str(r[h])) for r in results)]) for h in headers]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for r in results:
+        print("  ".join(str(r[h]).ljust(w) for h, w in zip(headers, widths)))
+
+
 def main():
     parser = argparse.ArgumentParser(description="Generate student assignment repositories")
     
@@ -240,6 +389,14 @@ def main():
     parser.add_argument("--token", default=os.getenv("GITEA_ADMIN_TOKEN", ""))
     parser.add_argument("--dry-run", action="store_true", help="Dry run mode")
     parser.add_argument("--skip-collaborator", action="store_true", help="Skip adding collaborators")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("PROVISION_WORKERS", "4")),
+                        help="Number of students provisioned concurrently (1 = serial)")
+    parser.add_argument("--report", help="Write the per-student result table to this CSV file")
+    parser.add_argument("--journal",
+                        help="Provisioning journal file (default: ~/.cache/gitea-autograde/provision/{org}__{assignment}.json)")
+    parser.add_argument("--no-journal", action="store_true", help="Do not read or write the provisioning journal")
+    parser.add_argument("--verify", action="store_true",
+                        help="List the organization's repositories once and reconcile the journal before provisioning")
     
     args = parser.parse_args()
     
@@ -269,15 +426,25 @@ def main():
     tests_repo_name = f"{args.assignment}-tests"
     repo_prefix = f"{args.assignment}-stu"
     
+    client = GiteaClient(args.gitea_url, args.token, pool_size=max(1, args.workers))
+    index = OrgRepoIndex(client, org)
+    
     # Ensure organization exists (create if needed)
     if not args.dry_run:
-        if not ensure_org_exists(args.gitea_url, args.token, org):
+        if not ensure_org_exists(client, org):
             print(f"Error: Failed to create organization {org}", file=sys.stderr)
             sys.exit(1)
         
-        # Ensure Template and Tests repos exist
-        ensure_repo_exists(args.gitea_url, args.token, org, template_repo_name, template_dir, is_private=False, is_template=True)
-        ensure_repo_exists(args.gitea_url, args.token, org, tests_repo_name, tests_dir, is_private=True, is_template=False)
+        # Ensure Template and Tests repos exist (concurrently)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            bootstrap = [
+                executor.submit(ensure_repo_exists, client, org, template_repo_name, template_dir,
+                                is_private=False, is_template=True, index=index),
+                executor.submit(ensure_repo_exists, client, org, tests_repo_name, tests_dir,
+                                is_private=True, is_template=False, index=index),
+            ]
+            for future in bootstrap:
+                future.result()
 
     # Read students
     if not Path(students_file).exists():
@@ -287,44 +454,86 @@ def main():
     students = read_student_list(students_file)
     print(f"Found {len(students)} students in {students_file}")
     
-    success_count = 0
-    fail_count = 0
-    
+    tasks = []
     for student_id, login in students:
         if student_id:
             repo_name = f"{repo_prefix}_{student_id}"
         else:
             repo_name = f"{repo_prefix}_{login}"
-        
-        if args.dry_run:
+        tasks.append((repo_name, login))
+    
+    if args.dry_run:
+        for repo_name, login in tasks:
             print(f"[DRY RUN] Would create {repo_name} for {login} in org {org}")
-            continue
-        
-        print(f"Creating {repo_name} for {login}...", end=" ")
-        
-        # Generate repo
-        repo_data = generate_student_repo(
-            args.gitea_url, args.token, org, 
-            template_repo_name, login, repo_name
-        )
-        
-        if repo_data is None:
-            fail_count += 1
-            print("FAILED (repo creation)")
-            continue
+        return
+    
+    journal = None
+    if not args.no_journal:
+        journal_path = args.journal or DEFAULT_CACHE_DIR / "provision" / f"{org}__{args.assignment}.json"
+        journal = ProvisionJournal(journal_path, org, args.assignment)
+        print(f"Journal: {journal_path}")
         
-        # Add collaborator
-        if args.skip_collaborator:
-            success_count += 1
-            print("OK (no collaborator)")
-        else:
-            if add_collaborator(args.gitea_url, args.token, org, repo_name, login):
-                success_count += 1
-                print("OK")
+        if args.verify:
+            print(f"Verifying against existing repositories in {org}...")
+            existing_repos = list_org_repo_names(client, org, index)
+            if existing_repos is None:
+                print("Error: Failed to list organization repositories", file=sys.stderr)
+                sys.exit(1)
+            found, missing = journal.reconcile(existing_repos, tasks)
+            print(f"  {found} existing repositories recorded, {missing} missing repositories reset")
+    elif args.verify:
+        print("Error: --verify requires the journal (remove --no-journal)", file=sys.stderr)
+        sys.exit(1)
+    
+    workers = max(1, args.workers)
+    print(f"Provisioning {len(tasks)} repositories with {workers} workers...")
+    
+    results = {}
+    created = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                provision_student,
+                client, org, template_repo_name,
+                repo_name, login, args.skip_collaborator, journal
+            ): repo_name
+            for repo_name, login in tasks
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            results[futures[future]] = result
+            if result["repo_status"] == "created":
+                created.append(result["repo"])
+            if not result["ok"]:
+                status = "FAILED (repo creation)"
+            elif result["repo_status"] == "done" and result["collaborator_status"] in ("done", "skipped"):
+                status = "OK (already provisioned)"
+            elif result["collaborator_status"] == "skipped":
+                status = "OK (no collaborator)"
+            elif result["collaborator_status"] == "failed":
+                status = "OK (repo created, collaborator failed)"
             else:
-                success_count += 1
-                print("OK (repo created, collaborator failed)")
+                status = "OK"
+            print(f"[{done}/{len(tasks)}] {result['repo']} for {result['login']}: {status}")
+    
+    # 新建的仓库一次写入组织仓库索引
+    index.add(created)
+    
+    # 按学生列表顺序输出结果表
+    ordered = [results[repo_name] for repo_name, _ in tasks]
+    print()
+    print_result_table(ordered)
+    
+    if args.report:
+        with open(args.report, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=["login", "repo", "repo_status", "collaborator_status", "elapsed"],
+                                    extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(ordered)
+        print(f"\nResult table saved to {args.report}")
     
+    success_count = sum(1 for r in ordered if r["ok"])
+    fail_count = len(ordered) - success_count
     print(f"\nSummary: {success_count} succeeded, {fail_count} failed")
 
 if __name__ == "__main__":
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Gitea API 客户端
+
+供管理脚本共用：keep-alive 连接池、分页、429/5xx 自动重试退避以及请求限速
+"""
+
+import os
+import random
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def detect_host(server_url: str, external_host: Optional[str]) -> str:
+    """检测 Gitea 主机地址"""
+    parsed = urlparse(server_url)
+    raw_host = parsed.netloc or parsed.path.split("/")[0]
+    host = raw_host
+    if raw_host.lower().startswith("gitea"):
+        host = external_host or "localhost:3000"
+    return host
+
+
+class RateLimiter:
+    """
+    按固定间隔限速（线程安全）
+
+    rate 为每秒最多请求数，0 或 None 表示不限速
+    """
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class GiteaClient:
+    """
+    Gitea API 客户端
+
+    Parameters
+    ----------
+    base_url : str
+        Gitea 服务器地址 (例如: http://localhost:3000)
+    token : str
+        访问 Token
+    pool_size : int
+        每个主机的最大连接数，超出时请求会排队等待空闲连接
+    retries : int
+        429/5xx 或连接错误时的最大重试次数
+    backoff : float
+        指数退避的基础秒数
+    rate_limit : float, optional
+        每秒最多请求数（默认读取 GITEA_RATE_LIMIT，0 表示不限速）
+    timeout : float
+        默认请求超时（秒）
+    """
+
+    def __init__(self, base_url, token, pool_size=10, retries=4, backoff=1.0, rate_limit=None, timeout=30):
+        self.base_url = base_url.rstrip("/")
+        self.api_url = f"{self.base_url}/api/v1"
+        self.token = token
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        if rate_limit is None:
+            rate_limit = float(os.getenv("GITEA_RATE_LIMIT", "0") or 0)
+        self.limiter = RateLimiter(rate_limit)
+
+        self.session = requests.Session()
+        if token:
+            self.session.headers["Authorization"] = f"token {token}"
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size), pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def url(self, path):
+        """API 路径（/repos/...）转为完整 URL；已是完整 URL 时原样返回"""
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.api_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, **kwargs):
+        """
+        发送请求，遇到 429/5xx 或连接错误时指数退避重试
+
+        优先使用服务端返回的 Retry-After；重试用尽后返回最后一次的响应
+        （或抛出最后一次的连接异常）。不会对 4xx 调用 raise_for_status，由调用方处理
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        url = self.url(path)
+
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == self.retries:
+                    raise
+                response = None
+
+            if response is not None and response.status_code not in RETRY_STATUS_CODES:
+                return response
+            if attempt == self.retries:
+                return response
+
+            delay = self.backoff * (2 ** attempt) + random.uniform(0, self.backoff)
+            retry_after = response.headers.get("Retry-After") if response is not None else None
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            time.sleep(delay)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request("PATCH", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    def paginate(self, path, params=None, limit=50):
+        """
+        逐页获取列表接口的所有条目
+
+        返回条目数少于 limit 时视为最后一页；HTTP 错误抛出 requests.HTTPError
+        """
+        params = dict(params or {})
+        page = 1
+        while True:
+            params.update({"page": page, "limit": limit})
+            response = self.get(path, params=params)
+            response.raise_for_status()
+            items = response.json()
+            if not items:
+                break
+            yield from items
+            if len(items) < limit:
+                break
+            page += 1
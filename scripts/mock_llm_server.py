@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+本地模拟 LLM 服务（OpenAI 兼容的 chat/completions 接口）
+
+用于在没有 API Key 和网络的环境中测试、压测 LLM 评分流程：
+- mock: 按提示词哈希生成确定性的评分 JSON（支持逐题和 --strategy single 的批量提示词）
+- record: 把请求转发给真实 API，并按提示词哈希保存响应
+- replay: 按提示词哈希返回已录制的响应，结果可重复
+
+所有模式都可以注入延迟、5xx 错误和带 Retry-After 的 429（record 模式不注入错误）。
+GET /stats 返回请求计数。
+
+用法:
+    python scripts/mock_llm_server.py --port 18000 --latency 0.5 --rate-limit-rate 0.1
+    LLM_API_URL=http://127.0.0.1:18000/v1/chat/completions python .autograde/llm_grade.py ...
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+
+import requests
+from dotenv import load_dotenv
+from repo_cache import DEFAULT_CACHE_DIR
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "autograde"))
+from llm_client import estimate_tokens  # noqa: E402
+
+load_dotenv()
+
+DEFAULT_REPLAY_DIR = DEFAULT_CACHE_DIR / "llm_replay"
+
+CRITERIA = ("accuracy", "coverage", "clarity")
+
+
+def prompt_key(model, messages):
+    """录制/回放的键：模型和消息列表的 SHA-256"""
+    payload = json.dumps([model, messages], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def mock_grade(seed_text):
+    """由文本哈希生成确定性的单题评分"""
+    digest = hashlib.sha256(seed_text.encode("utf-8")).digest()
+    scores = [digest[i] % 4 for i in range(len(CRITERIA))]
+    confidence = 0.6 + (digest[3] % 40) / 100
+    return {
+        "total": round(sum(scores) * 10 / 9, 2),
+        "criteria": [
+            {"id": criterion_id, "score": score, "reason": "mock"}
+            for criterion_id, score in zip(CRITERIA, scores)
+        ],
+        "flags": [],
+        "confidence": round(confidence, 2)
+    }
+
+
+def mock_content(prompt):
+    """
+    为提示词生成模拟的评分结果
+
+    批量提示词（含【题目 saN】）返回 {"results": [...]}，否则返回单题评分
+    """
+    item_ids = []
+    for line in prompt.splitlines():
+        if line.startswith("【题目 ") and line.endswith("】"):
+            item_ids.append(line[len("【题目 "):-1])
+    if item_ids:
+        return {"results": [{"id": item_id, **mock_grade(f"{item_id}\n{prompt}")} for item_id in item_ids]}
+    return mock_grade(prompt)
+
+
+def completion_response(model, prompt, content):
+    """包装为 chat/completions 响应，usage 为估算的 token 数"""
+    text = json.dumps(content, ensure_ascii=False)
+    prompt_tokens = estimate_tokens(prompt)
+    completion_tokens = estimate_tokens(text)
+    return {
+        "id": f"mock-{hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": text},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """
+    模拟 LLM 服务（线程安全）
+
+    Parameters
+    ----------
+    address : tuple
+        (host, port)，port 为 0 时自动分配
+    mode : str
+        mock / record / replay
+    latency : float
+        成功响应前的固定延迟（秒）
+    jitter : float
+        额外的随机延迟上限（秒）
+    error_rate : float
+        返回 503 的请求比例
+    rate_limit_rate : float
+        返回 429 的请求比例
+    retry_after : float
+        429/503 响应中的 Retry-After（秒）
+    replay_dir : str or Path, optional
+        录制文件目录（默认 ~/.cache/gitea-autograde/llm_replay）
+    upstream_url, upstream_key : str, optional
+        record 模式转发的真实 API 地址和密钥
+    seed : int, optional
+        随机数种子，相同种子下注入的错误序列相同
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, mode="mock", latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1.0, replay_dir=None, upstream_url=None, upstream_key=None, seed=None):
+        super().__init__(address, MockLLMHandler)
+        self.mode = mode
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.replay_dir = Path(replay_dir) if replay_dir else DEFAULT_REPLAY_DIR
+        self.upstream_url = upstream_url
+        self.upstream_key = upstream_key
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.reset_stats()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {
+                "requests": 0, "ok": 0, "injected_429": 0, "injected_5xx": 0,
+                "replay_hits": 0, "replay_misses": 0, "recorded": 0,
+                "prompt_tokens": 0, "completion_tokens": 0
+            }
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def count_usage(self, response):
+        usage = response.get("usage") or {}
+        self.count("prompt_tokens", int(usage.get("prompt_tokens", 0) or 0))
+        self.count("completion_tokens", int(usage.get("completion_tokens", 0) or 0))
+
+    def draw(self):
+        """按种子抽取本次请求的注入结果和延迟：(状态码或 None, 延迟秒数)"""
+        with self.lock:
+            r = self.rng.random()
+            delay = self.latency + self.rng.uniform(0, self.jitter)
+        if r < self.rate_limit_rate:
+            return 429, 0.0
+        if r < self.rate_limit_rate + self.error_rate:
+            return 503, 0.0
+        return None, delay
+
+    def replay_path(self, key):
+        return self.replay_dir / key[:2] / f"{key}.json"
+
+    def load_recording(self, key):
+        try:
+            with open(self.replay_path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_recording(self, key, response):
+        path = self.replay_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(response, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def forward(self, body, authorization):
+        """record 模式：转发给真实 API，返回 (状态码, 响应 dict)"""
+        headers = {"Content-Type": "application/json"}
+        if self.upstream_key:
+            headers["Authorization"] = f"Bearer {self.upstream_key}"
+        elif authorization:
+            headers["Authorization"] = authorization
+        response = requests.post(self.upstream_url, json=body, headers=headers, timeout=(10, 120))
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, {"error": {"message": response.text}}
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, obj, headers=None):
+        data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            with self.server.lock:
+                return self.send_json(200, dict(self.server.stats))
+        return self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self.send_json(400, {"error": {"message": "invalid JSON body"}})
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self.send_json(404, {"error": {"message": "not found"}})
+
+        server.count("requests")
+        model = body.get("model", "mock")
+        messages = body.get("messages", [])
+        prompt = "\n".join(str(m.get("content", "")) for m in messages)
+        key = prompt_key(model, messages)
+
+        if server.mode == "record":
+            try:
+                status, response = server.forward(body, self.headers.get("Authorization"))
+            except requests.exceptions.RequestException as e:
+                return self.send_json(502, {"error": {"message": f"upstream request failed: {e}"}})
+            if status == 200:
+                server.save_recording(key, response)
+                server.count("recorded")
+                server.count_usage(response)
+            return self.send_json(status, response)
+
+        status, delay = server.draw()
+        if status is not None:
+            server.count("injected_429" if status == 429 else "injected_5xx")
+            message = "rate limit exceeded" if status == 429 else "service unavailable"
+            return self.send_json(status, {"error": {"message": f"{message} (injected)"}},
+                                  {"Retry-After": f"{server.retry_after:g}"})
+
+        if server.mode == "replay":
+            response = server.load_recording(key)
+            if response is None:
+                server.count("replay_misses")
+                return self.send_json(404, {"error": {"message": f"no recording for prompt {key[:12]}"}})
+            server.count("replay_hits")
+        else:
+            response = completion_response(model, prompt, mock_content(prompt))
+
+        time.sleep(delay)
+        server.count("ok")
+        server.count_usage(response)
+        return self.send_json(200, response)
+
+
+def add_server_arguments(parser):
+    """模拟服务的参数（bench_llm_grade.py 共用）"""
+    parser.add_argument("--mode", choices=["mock", "record", "replay"], default="mock",
+                        help="mock: 生成确定性评分; record: 转发真实 API 并录制; replay: 回放录制的响应")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个成功响应的固定延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="额外随机延迟的上限（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 503 的请求比例 (0-1)")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的请求比例 (0-1)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429/503 响应的 Retry-After（秒）")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子（注入的错误和延迟可重复）")
+    parser.add_argument("--replay-dir", default=str(DEFAULT_REPLAY_DIR), help="录制文件目录")
+    parser.add_argument("--upstream-url", default=os.getenv("LLM_API_URL", "https://api.deepseek.com/chat/completions"),
+                        help="record 模式转发的真实 API 地址")
+    parser.add_argument("--upstream-key", default=os.getenv("LLM_API_KEY", ""),
+                        help="record 模式使用的 API 密钥（默认透传请求的 Authorization）")
+
+
+def create_server(args, host="127.0.0.1", port=0):
+    return MockLLMServer(
+        (host, port),
+        mode=args.mode,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        replay_dir=args.replay_dir,
+        upstream_url=args.upstream_url,
+        upstream_key=args.upstream_key,
+        seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="本地模拟 LLM 服务（OpenAI 兼容），用于离线测试和压测 LLM 评分",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+  # 模拟服务：0.5 秒延迟，10% 的请求返回 429
+  python scripts/mock_llm_server.py --latency 0.5 --rate-limit-rate 0.1
+
+  # 录制真实 API 的响应，之后离线回放
+  python scripts/mock_llm_server.py --mode record
+  python scripts/mock_llm_server.py --mode replay
+        """
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=18000, help="监听端口")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    if args.mode == "record" and not args.upstream_url:
+        print("Error: --upstream-url (or LLM_API_URL) is required in record mode", file=sys.stderr)
+        sys.exit(1)
+
+    server = create_server(args, args.host, args.port)
+    print(f"🤖 Mock LLM server ({args.mode}) listening on {server.url}")
+    if args.mode != "mock":
+        print(f"   Recordings: {server.replay_dir}")
+    print(f"   Stats: http://{args.host}:{server.server_address[1]}/stats")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"\n📊 {json.dumps(server.stats)}")
+
+
+if __name__ == "__main__":
+    main()
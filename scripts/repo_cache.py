@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+学生仓库本地缓存
+
+MirrorCache: 持久的 bare 镜像目录，首次使用时完整获取，之后只 fetch 增量；
+按最近使用时间和总大小淘汰旧镜像
+OrgRepoIndex: 组织仓库列表的磁盘缓存，TTL 内直接使用，过期后按页用 ETag 重新验证
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+
+# 导入时即读取 .env，使 AUTOGRADE_CACHE_DIR 在导入本模块的脚本调用 load_dotenv() 之前生效
+load_dotenv()
+
+# 本地缓存根目录（各脚本共用）
+DEFAULT_CACHE_DIR = Path(os.getenv("AUTOGRADE_CACHE_DIR", Path.home() / ".cache" / "gitea-autograde"))
+
+
+def dir_size(path):
+    """目录下所有文件的总大小（字节）"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class MirrorCache:
+    """
+    学生仓库的 bare 镜像缓存（线程安全）
+
+    镜像位于 {root}/{org}/{repo}.git。同步时 Token 只出现在 fetch 命令行中，
+    不会写入镜像的 git 配置。使用方通过 `git clone --shared` 从镜像创建工作目录，
+    对象通过 alternates 共享，无需再次传输。
+
+    Parameters
+    ----------
+    root : str or Path, optional
+        缓存目录（默认 ~/.cache/gitea-autograde/mirrors）
+    max_bytes : int, optional
+        缓存总大小上限，evict() 时按最近使用时间淘汰；None 表示不限制
+    """
+
+    def __init__(self, root=None, max_bytes=None):
+        self.root = Path(root) if root else DEFAULT_CACHE_DIR / "mirrors"
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.repo_locks = {}
+        self.in_use = set()
+
+    def path_for(self, org, repo_name):
+        return self.root / org / f"{repo_name}.git"
+
+    def _repo_lock(self, mirror_path):
+        with self.lock:
+            return self.repo_locks.setdefault(mirror_path, threading.Lock())
+
+    def sync(self, remote_url, org, repo_name):
+        """
+        同步镜像：不存在时初始化 bare 仓库，然后 fetch --prune 所有分支
+
+        返回镜像路径（使用完毕后调用 release）；git 失败时抛出 subprocess.CalledProcessError
+        """
+        mirror_path = self.path_for(org, repo_name)
+        with self._repo_lock(mirror_path):
+            if not (mirror_path / "HEAD").is_file():
+                mirror_path.mkdir(parents=True, exist_ok=True)
+                subprocess.run(["git", "init", "-q", "--bare", str(mirror_path)],
+                               check=True, capture_output=True, text=True)
+
+            subprocess.run(
+                ["git", "-C", str(mirror_path), "fetch", "-q", "--prune", "--no-tags",
+                 remote_url, "+refs/heads/*:refs/heads/*"],
+                check=True,
+                capture_output=True,
+                text=True
+            )
+            # 记录最近使用时间，用于 LRU 淘汰
+            now = time.time()
+            os.utime(mirror_path, (now, now))
+
+        with self.lock:
+            self.in_use.add(mirror_path)
+        return mirror_path
+
+    def release(self, mirror_path):
+        """标记镜像不再被本进程使用，允许被淘汰"""
+        with self.lock:
+            self.in_use.discard(mirror_path)
+
+    def evict(self):
+        """
+        按最近使用时间淘汰镜像，直到总大小不超过 max_bytes
+
+        正在使用的镜像不会被删除。返回被删除的镜像路径列表
+        """
+        if self.max_bytes is None or not self.root.is_dir():
+            return []
+
+        mirrors = []
+        for org_dir in self.root.iterdir():
+            if org_dir.is_dir():
+                for mirror_path in org_dir.glob("*.git"):
+                    mirrors.append((mirror_path.stat().st_mtime, mirror_path, dir_size(mirror_path)))
+
+        total = sum(size for _, _, size in mirrors)
+        removed = []
+        for _, mirror_path, size in sorted(mirrors):
+            if total <= self.max_bytes:
+                break
+            with self.lock:
+                if mirror_path in self.in_use:
+                    continue
+            shutil.rmtree(mirror_path, ignore_errors=True)
+            total -= size
+            removed.append(mirror_path)
+
+        return removed
+
+
+class OrgRepoIndex:
+    """
+    组织仓库列表缓存（线程安全）
+
+    缓存文件位于 {root}/{host}__{org}.json，按页保存仓库的精简信息和 ETag。
+    缓存未超过 TTL 时不发送请求；过期后逐页发送带 If-None-Match 的请求，
+    304 的页直接复用缓存。创建/删除仓库的脚本通过 add()/remove() 同步更新缓存，
+    连续运行多个管理命令时不必重复列出整个组织。
+
+    Parameters
+    ----------
+    client : GiteaClient
+        Gitea 客户端
+    org : str
+        组织名称
+    root : str or Path, optional
+        缓存目录（默认 ~/.cache/gitea-autograde/repo_index）
+    ttl : float, optional
+        缓存有效期（秒，默认读取 REPO_INDEX_TTL，默认 300）
+    """
+
+    PAGE_LIMIT = 50
+    FIELDS = ("id", "name", "private", "template", "empty")
+
+    def __init__(self, client, org, root=None, ttl=None):
+        self.client = client
+        self.org = org
+        self.ttl = float(os.getenv("REPO_INDEX_TTL", "300")) if ttl is None else ttl
+        root = Path(root) if root else DEFAULT_CACHE_DIR / "repo_index"
+        host = urlparse(client.base_url).netloc.replace(":", "_")
+        self.path = root / f"{host}__{org}.json"
+        self.lock = threading.Lock()
+        self.data = None
+
+    def _load(self):
+        if self.data is None:
+            self.data = {"org": self.org, "fetched_at": 0, "pages": []}
+            if self.path.exists():
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self.data = json.load(f)
+                except (OSError, ValueError):
+                    pass
+        return self.data
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _fetch(self, cached_pages):
+        """逐页列出组织仓库，带 ETag 的页发送条件请求；HTTP 错误抛出 requests.HTTPError"""
+        pages = []
+        page = 1
+        while True:
+            old = cached_pages[page - 1] if page <= len(cached_pages) else None
+            headers = {"If-None-Match": old["etag"]} if old and old.get("etag") else {}
+            response = self.client.get(
+                f"/orgs/{self.org}/repos",
+                params={"page": page, "limit": self.PAGE_LIMIT},
+                headers=headers
+            )
+            if response.status_code == 304:
+                pages.append(old)
+                repos = old["repos"]
+            else:
+                response.raise_for_status()
+                repos = [{key: repo.get(key) for key in self.FIELDS} for repo in response.json()]
+                pages.append({"etag": response.headers.get("ETag"), "repos": repos})
+            if len(repos) < self.PAGE_LIMIT:
+                break
+            page += 1
+        return pages
+
+    def repos(self, refresh=False):
+        """
+        返回组织下所有仓库（精简信息 dict 列表）
+
+        refresh=True 时忽略 TTL，立即重新验证
+        """
+        with self.lock:
+            data = self._load()
+            expired = time.time() - data.get("fetched_at", 0) > self.ttl
+            if refresh or expired or not data.get("pages"):
+                data["pages"] = self._fetch(data.get("pages") or [])
+                data["fetched_at"] = time.time()
+                self._save()
+            return [repo for page in data["pages"] for repo in page["repos"]]
+
+    def with_prefix(self, prefix, refresh=False):
+        """返回名称以 prefix（单个前缀或前缀列表）开头的仓库"""
+        prefixes = (prefix,) if isinstance(prefix, str) else tuple(prefix)
+        return [repo for repo in self.repos(refresh) if repo["name"].startswith(prefixes)]
+
+    def names(self, refresh=False):
+        """返回组织下所有仓库名称的集合"""
+        return {repo["name"] for repo in self.repos(refresh)}
+
+    def add(self, repos):
+        """
+        记录新创建的仓库
+
+        repos 为 API 返回的仓库 dict 或仓库名称，或它们的列表；批量创建时应收集后一次调用，
+        缓存文件只写一次
+        """
+        if isinstance(repos, (str, dict)):
+            repos = [repos]
+        repos = [{"name": repo} if isinstance(repo, str) else repo for repo in repos]
+        with self.lock:
+            data = self._load()
+            if not data.get("pages") or not repos:
+                return
+            known = {r["name"] for page in data["pages"] for r in page["repos"]}
+            new_repos = []
+            for repo in repos:
+                if repo["name"] not in known:
+                    known.add(repo["name"])
+                    new_repos.append({key: repo.get(key) for key in self.FIELDS})
+            if not new_repos:
+                return
+            # 追加到末尾无 ETag 的页（没有时新建），下次重新验证时会被完整列表替换
+            if data["pages"][-1].get("etag") is not None:
+                data["pages"].append({"etag": None, "repos": []})
+            data["pages"][-1]["repos"].extend(new_repos)
+            self._save()
+
+    def remove(self, names):
+        """从缓存中移除已删除的仓库"""
+        names = {names} if isinstance(names, str) else set(names)
+        with self.lock:
+            data = self._load()
+            for page in data.get("pages") or []:
+                kept = [r for r in page["repos"] if r["name"] not in names]
+                if len(kept) != len(page["repos"]):
+                    page["repos"] = kept
+                    # 页内容已改变，不能再用原 ETag 验证
+                    page["etag"] = None
+            self._save()
@@ -10,6 +10,24 @@ import shutil
 import sys
 from pathlib import Path
 
+
+def copy_answer_templates(template_dir, autograde_dir):
+    """
+    Copy the assignment's answers/saN.md into .autograde/answer_templates/ so that
+    llm_grade.py in CI can recognise untouched template lines and headings.
+    Returns the number of files copied.
+    """
+    answers_dir = Path(template_dir) / "answers"
+    answer_files = sorted(answers_dir.glob("sa*.md")) if answers_dir.is_dir() else []
+    if not answer_files:
+        return 0
+    dest = Path(autograde_dir) / "answer_templates"
+    dest.mkdir(parents=True, exist_ok=True)
+    for answer_file in answer_files:
+        shutil.copy2(answer_file, dest / answer_file.name)
+    return len(answer_files)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Sync autograde scripts to assignment templates")
     parser.add_argument("--course", help="Course directory (e.g., courses/CS101). If not specified, sync to all courses.")
@@ -62,6 +80,7 @@ def main():
             # Copy files using rsync-like behavior (overwrite)
             try:
                 shutil.copytree(common_autograde, template_autograde, dirs_exist_ok=True)
+                copy_answer_templates(assignment / "template", template_autograde)
                 print(f"  ✅ Synced {assignment.name}")
             except Exception as e:
                 print(f"  ❌ Failed to sync {assignment.name}: {e}")
@@ -65,6 +65,18 @@ if [ -n "$LLM_MODEL" ]; then
     echo "  ✓ LLM_MODEL: $LLM_MODEL"
 fi
 
+# 更新 LLM_CACHE_DIR（可选，需要在 config.yaml 的 container 部分挂载对应的卷）
+if [ -n "$LLM_CACHE_DIR" ]; then
+    sed -i '' "s|LLM_CACHE_DIR:.*|LLM_CACHE_DIR: $LLM_CACHE_DIR|g" "$CONFIG_FILE"
+    echo "  ✓ LLM_CACHE_DIR: $LLM_CACHE_DIR"
+fi
+
+# 更新 LLM_MAX_ANSWER_TOKENS（可选）
+if [ -n "$LLM_MAX_ANSWER_TOKENS" ]; then
+    sed -i '' "s|LLM_MAX_ANSWER_TOKENS:.*|LLM_MAX_ANSWER_TOKENS: \"$LLM_MAX_ANSWER_TOKENS\"|g" "$CONFIG_FILE"
+    echo "  ✓ LLM_MAX_ANSWER_TOKENS: $LLM_MAX_ANSWER_TOKENS"
+fi
+
 echo ""
 echo "✅ Configuration synced successfully!"
 echo ""
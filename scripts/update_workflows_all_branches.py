@@ -7,224 +7,436 @@
 
 import os
 import sys
+import base64
+import hashlib
 import argparse
-import requests
 import tempfile
+import threading
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+from gitea_client import GiteaClient
+from repo_cache import MirrorCache, OrgRepoIndex
 
 load_dotenv()
 
+# 已被 create_minimal_metadata.py 替代，更新时从学生仓库中删除
+OBSOLETE_FILES = [".autograde/create_grade_metadata.py"]
 
-def get_repos(gitea_url, token, org, prefix):
-    """获取所有匹配前缀的仓库列表"""
-    api_url = f"{gitea_url}/api/v1/orgs/{org}/repos"
-    headers = {"Authorization": f"token {token}"}
-    
+COMMIT_AUTHOR = {"name": "Gitea Actions", "email": "gitea-actions@noreply.localhost"}
+
+
+def get_repos(client, org, prefix, refresh=False):
+    """获取所有匹配前缀的仓库列表（来自组织仓库索引缓存）"""
     repos = []
-    page = 1
-    per_page = 50
-    
-    while True:
-        params = {"page": page, "limit": per_page}
-        try:
-            response = requests.get(api_url, headers=headers, params=params, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            
-            if not data:
-                break
-            
-            for repo in data:
-                if repo["name"].startswith(prefix):
-                    repos.append(repo["name"])
-            
-            if len(data) < per_page:
-                break
-            
-            page += 1
-        except Exception as e:
-            print(f"Error fetching repos: {e}", file=sys.stderr)
-            break
+    try:
+        repos = [repo["name"] for repo in OrgRepoIndex(client, org).with_prefix(prefix, refresh=refresh)]
+    except Exception as e:
+        print(f"Error fetching repos: {e}", file=sys.stderr)
     
     return repos
 
 
-def get_branches(gitea_url, token, org, repo_name):
+def get_branches(client, org, repo_name):
     """获取仓库的所有分支"""
-    api_url = f"{gitea_url}/api/v1/repos/{org}/{repo_name}/branches"
-    headers = {"Authorization": f"token {token}"}
-    
     try:
-        response = requests.get(api_url, headers=headers, timeout=30)
-        response.raise_for_status()
-        branches = [b["name"] for b in response.json()]
-        return branches
+        return [b["name"] for b in client.paginate(f"/repos/{org}/{repo_name}/branches", limit=50)]
     except Exception as e:
         print(f"Error fetching branches: {e}", file=sys.stderr)
         return []
 
 
-def update_workflow_in_branch(gitea_url, token, org, repo_name, branch, template_workflow_dir):
-    """更新指定分支的 workflow 文件"""
-    with tempfile.TemporaryDirectory() as temp_dir:
-        repo_dir = os.path.join(temp_dir, repo_name)
+def git(repo_dir, *args, check=True):
+    """在 repo_dir 中运行 git 命令"""
+    return subprocess.run(
+        ["git", "-C", repo_dir, *args],
+        check=check,
+        capture_output=True,
+        text=True
+    )
+
+
+def git_error(e, token=None):
+    """git 命令的错误信息（stderr 为空时为异常描述，其中包含命令行），隐去其中的 Token"""
+    message = e.stderr or str(e)
+    if token:
+        message = message.replace(token, "***")
+    return message
+
+
+def load_template_files(template_workflow_dir):
+    """
+    读取需要同步到学生仓库的模板文件
+
+    包括 .gitea/workflows/*.yml|*.yaml 和模板 .autograde/*.py；
+    返回 {仓库内相对路径: 文件内容(bytes)}
+    """
+    files = {}
+    
+    if os.path.isdir(template_workflow_dir):
+        for filename in sorted(os.listdir(template_workflow_dir)):
+            if filename.endswith(('.yml', '.yaml')):
+                with open(os.path.join(template_workflow_dir, filename), 'rb') as f:
+                    files[f".gitea/workflows/{filename}"] = f.read()
+    
+    # 同时更新 .autograde 目录
+    template_autograde_dir = os.path.join(os.path.dirname(template_workflow_dir), "..", ".autograde")
+    template_autograde_dir = os.path.normpath(template_autograde_dir)
+    
+    if os.path.isdir(template_autograde_dir):
+        for filename in sorted(os.listdir(template_autograde_dir)):
+            if filename.endswith('.py'):
+                with open(os.path.join(template_autograde_dir, filename), 'rb') as f:
+                    files[f".autograde/{filename}"] = f.read()
+    
+    return files
+
+
+def git_blob_sha(content):
+    """计算内容的 git blob SHA（与 git hash-object 相同）"""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def build_template_manifest(template_files):
+    """
+    预先计算模板文件的 git blob SHA
+
+    返回 {仓库内相对路径: blob sha}，用于与分支的远程文件树比较
+    """
+    return {rel_path: git_blob_sha(content) for rel_path, content in template_files.items()}
+
+
+def apply_template_files(repo_dir, template_workflow_dir):
+    """
+    将模板的 workflow 文件和 .autograde 脚本复制到工作目录
+
+    返回是否复制了任何文件
+    """
+    updated = False
+    
+    # 删除旧的 create_grade_metadata.py（已被 create_minimal_metadata.py 替代）
+    for rel_path in OBSOLETE_FILES:
+        old_path = os.path.join(repo_dir, rel_path)
+        if os.path.exists(old_path):
+            os.remove(old_path)
+            updated = True
+    
+    for rel_path, content in load_template_files(template_workflow_dir).items():
+        dst = os.path.join(repo_dir, rel_path)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        with open(dst, 'wb') as f:
+            f.write(content)
         
-        # 克隆仓库
-        if token:
-            clone_url = f"http://oauth2:{token}@{gitea_url.replace('http://', '').replace('https://', '')}/{org}/{repo_name}.git"
-        else:
-            clone_url = f"{gitea_url}/{org}/{repo_name}.git"
+        # 设置执行权限
+        if rel_path.startswith(".autograde/"):
+            os.chmod(dst, 0o755)
+        updated = True
+    
+    return updated
+
+
+def get_branch_tree(client, org, repo_name, ref):
+    """
+    通过 git trees API 递归获取分支的文件列表
+
+    返回 {path: blob sha}；分支不存在时返回 None，其他错误抛出异常
+    """
+    tree = {}
+    page = 1
+    while True:
+        response = client.get(
+            f"/repos/{org}/{repo_name}/git/trees/{ref}",
+            params={"recursive": "true", "page": page, "per_page": 1000}
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        data = response.json()
         
+        entries = data.get("tree") or []
+        for entry in entries:
+            if entry.get("type") == "blob":
+                tree[entry["path"]] = entry.get("sha")
+        
+        if not data.get("truncated") or not entries:
+            break
+        page += 1
+    
+    return tree
+
+
+def is_branch_up_to_date(tree, manifest):
+    """分支文件树中的模板文件是否都与 manifest 一致（且不含已废弃的文件）"""
+    return (
+        all(tree.get(rel_path) == sha for rel_path, sha in manifest.items())
+        and not any(rel_path in tree for rel_path in OBSOLETE_FILES)
+    )
+
+
+def find_outdated_branches(client, org, repo_name, branches, manifest):
+    """
+    通过 trees API 找出需要更新的分支，无需克隆
+
+    不存在的分支（需要从 main 创建）或查询失败的分支都视为需要更新
+    """
+    outdated = []
+    for branch in branches:
         try:
-            # 克隆
-            subprocess.run(
-                ["git", "clone", "--depth", "1", clone_url, repo_dir],
-                check=True,
-                capture_output=True,
-                text=True
-            )
-            
-            # 获取所有分支
-            subprocess.run(
-                ["git", "-C", repo_dir, "fetch", "--all"],
-                check=True,
-                capture_output=True
-            )
-            
-            # 切换到目标分支
-            try:
-                # 先尝试从远程获取分支
-                subprocess.run(
-                    ["git", "-C", repo_dir, "fetch", "origin", f"{branch}:{branch}"],
-                    capture_output=True
-                )
-                # 切换到分支
-                subprocess.run(
-                    ["git", "-C", repo_dir, "checkout", branch],
-                    check=True,
-                    capture_output=True
-                )
-            except subprocess.CalledProcessError:
-                # 如果分支不存在，从 main 创建
-                try:
-                    subprocess.run(
-                        ["git", "-C", repo_dir, "checkout", "main"],
-                        check=True,
-                        capture_output=True
-                    )
-                    subprocess.run(
-                        ["git", "-C", repo_dir, "checkout", "-b", branch],
-                        check=True,
-                        capture_output=True
-                    )
-                except:
-                    # 如果 main 也不存在，使用当前分支
-                    pass
-            
-            # 更新 workflow 文件
-            repo_workflow_dir = os.path.join(repo_dir, ".gitea", "workflows")
-            os.makedirs(repo_workflow_dir, exist_ok=True)
-            
-            updated = False
-            if os.path.isdir(template_workflow_dir):
-                for filename in os.listdir(template_workflow_dir):
-                    if filename.endswith(('.yml', '.yaml')):
-                        src = os.path.join(template_workflow_dir, filename)
-                        dst = os.path.join(repo_workflow_dir, filename)
-                        
-                        with open(src, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                        
-                        with open(dst, 'w', encoding='utf-8') as f:
-                            f.write(content)
-                        
-                        updated = True
-            
-            # 同时更新 .autograde 目录
-            template_autograde_dir = os.path.join(os.path.dirname(template_workflow_dir), "..", ".autograde")
-            template_autograde_dir = os.path.normpath(template_autograde_dir)
-            repo_autograde_dir = os.path.join(repo_dir, ".autograde")
-            
-            if os.path.isdir(template_autograde_dir):
-                os.makedirs(repo_autograde_dir, exist_ok=True)
-                
-                # 删除旧的 create_grade_metadata.py（已被 create_minimal_metadata.py 替代）
-                old_metadata_script = os.path.join(repo_autograde_dir, "create_grade_metadata.py")
-                if os.path.exists(old_metadata_script):
-                    os.remove(old_metadata_script)
-                    updated = True
-                
-                for filename in os.listdir(template_autograde_dir):
-                    if filename.endswith('.py'):
-                        src = os.path.join(template_autograde_dir, filename)
-                        dst = os.path.join(repo_autograde_dir, filename)
-                        
-                        with open(src, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                        
-                        with open(dst, 'w', encoding='utf-8') as f:
-                            f.write(content)
-                        
-                        # 设置执行权限
-                        os.chmod(dst, 0o755)
-                        updated = True
-            
-            if not updated:
-                return True
-            
-            # 配置 git
-            subprocess.run(
-                ["git", "-C", repo_dir, "config", "user.name", "Gitea Actions"],
-                check=True,
-                capture_output=True
-            )
-            subprocess.run(
-                ["git", "-C", repo_dir, "config", "user.email", "gitea-actions@noreply.localhost"],
-                check=True,
-                capture_output=True
-            )
-            
-            # 添加文件
-            subprocess.run(
-                ["git", "-C", repo_dir, "add", ".gitea/workflows/", ".autograde/"],
-                check=True,
-                capture_output=True
-            )
-            
-            # 检查是否有更改
-            result = subprocess.run(
-                ["git", "-C", repo_dir, "diff", "--cached", "--quiet"],
-                capture_output=True
-            )
+            tree = get_branch_tree(client, org, repo_name, branch)
+        except Exception as e:
+            print(f"  ⚠️ Error listing tree of {repo_name}@{branch}: {e}", file=sys.stderr)
+            tree = None
+        if tree is None or not is_branch_up_to_date(tree, manifest):
+            outdated.append(branch)
+    return outdated
+
+
+def diff_template_files(tree, template_files, manifest):
+    """
+    比较分支文件列表与模板文件，生成 contents API 的文件操作列表
+
+    内容（blob SHA）与 manifest 相同的文件不会出现在结果中
+    """
+    operations = []
+    for rel_path, content in template_files.items():
+        remote_sha = tree.get(rel_path)
+        if remote_sha == manifest[rel_path]:
+            continue
+        operation = {
+            "operation": "update" if remote_sha else "create",
+            "path": rel_path,
+            "content": base64.b64encode(content).decode("ascii"),
+        }
+        if remote_sha:
+            operation["sha"] = remote_sha
+        operations.append(operation)
+    
+    for rel_path in OBSOLETE_FILES:
+        if rel_path in tree:
+            operations.append({"operation": "delete", "path": rel_path, "sha": tree[rel_path]})
+    
+    return operations
+
+
+def update_workflows_via_api(client, org, repo_name, branches, template_files, manifest, push_slots=None):
+    """
+    不克隆仓库，通过 contents API 更新多个分支的 workflow 文件
+
+    每个分支先用 trees API 比较 blob SHA，只有存在差异时才通过
+    POST /repos/{owner}/{repo}/contents 一次提交所有变更的文件；
+    分支不存在时从 main 创建。
+    push_slots 为 threading.Semaphore 时，提交前需先获取（提交同样由 Gitea 的 git 后端完成）。
+    返回 {branch: "updated" | "unchanged" | "failed"}
+    """
+    results = {}
+    main_tree = None
+    
+    for branch in branches:
+        try:
+            payload = {
+                "branch": branch,
+                "message": f"Update workflow files from template (branch: {branch})",
+                "author": COMMIT_AUTHOR,
+                "committer": COMMIT_AUTHOR,
+            }
             
-            if result.returncode == 0:
-                return True  # 没有更改
+            tree = get_branch_tree(client, org, repo_name, branch)
+            if tree is None:
+                # 分支不存在，从 main 创建
+                if main_tree is None:
+                    main_tree = get_branch_tree(client, org, repo_name, "main")
+                if main_tree is None:
+                    print(f"  ⚠️ Branch {branch} not found and no main branch to create it from", file=sys.stderr)
+                    results[branch] = "failed"
+                    continue
+                tree = main_tree
+                payload.update({"branch": "main", "new_branch": branch})
             
-            # 提交
-            subprocess.run(
-                ["git", "-C", repo_dir, "commit", "-m", f"Update workflow files from template (branch: {branch})"],
-                check=True,
-                capture_output=True
-            )
+            operations = diff_template_files(tree, template_files, manifest)
+            if not operations:
+                results[branch] = "unchanged"
+                continue
             
-            # 推送
-            if token:
-                push_url = f"http://oauth2:{token}@{gitea_url.replace('http://', '').replace('https://', '')}/{org}/{repo_name}.git"
+            payload["files"] = operations
+            if push_slots is not None:
+                with push_slots:
+                    response = client.post(f"/repos/{org}/{repo_name}/contents", json=payload, timeout=120)
             else:
-                push_url = f"{gitea_url}/{org}/{repo_name}.git"
-            
-            subprocess.run(
-                ["git", "-C", repo_dir, "push", push_url, branch],
-                check=True,
-                capture_output=True
-            )
-            
-            return True
+                response = client.post(f"/repos/{org}/{repo_name}/contents", json=payload, timeout=120)
+            if response.status_code in (200, 201):
+                results[branch] = "updated"
+            else:
+                print(f"  ⚠️ Error updating branch {branch}: {response.status_code} {response.text}", file=sys.stderr)
+                results[branch] = "failed"
+        except Exception as e:
+            print(f"  ⚠️ Error updating branch {branch}: {e}", file=sys.stderr)
+            results[branch] = "failed"
+    
+    return results
+
+
+def update_workflows_in_repo(gitea_url, token, org, repo_name, branches, template_workflow_dir, push_slots=None,
+                             mirror_cache=None):
+    """
+    更新仓库中多个分支的 workflow 文件
+
+    只克隆一次（浅克隆所有分支），在同一个工作目录中依次检出每个分支、
+    应用模板并提交，最后用一次 git push 推送所有有变更的分支。
+    push_slots 为 threading.Semaphore 时，推送前需先获取，用于限制同时推送的数量。
+    提供 mirror_cache (repo_cache.MirrorCache) 时，先增量同步本地镜像，再从镜像
+    `clone --shared` 出工作目录，只传输自上次以来的变更。
+    返回 {branch: "updated" | "unchanged" | "failed"}
+    """
+    results = {}
+    
+    if token:
+        remote_url = f"http://oauth2:{token}@{gitea_url.replace('http://', '').replace('https://', '')}/{org}/{repo_name}.git"
+    else:
+        remote_url = f"{gitea_url}/{org}/{repo_name}.git"
+    
+    mirror_path = None
+    with tempfile.TemporaryDirectory() as temp_dir:
+        repo_dir = os.path.join(temp_dir, repo_name)
+        
+        try:
+            if mirror_cache is not None:
+                # 从本地镜像克隆，对象通过 alternates 共享
+                mirror_path = mirror_cache.sync(remote_url, org, repo_name)
+                clone_cmd = ["git", "clone", "-q", "--shared", "--no-checkout", str(mirror_path), repo_dir]
+            else:
+                # 克隆（所有分支，各分支只取最新提交）
+                clone_cmd = ["git", "clone", "--depth", "1", "--no-single-branch", "--no-checkout", remote_url, repo_dir]
+            subprocess.run(clone_cmd, check=True, capture_output=True, text=True)
             
+            # 配置 git
+            git(repo_dir, "config", "user.name", COMMIT_AUTHOR["name"])
+            git(repo_dir, "config", "user.email", COMMIT_AUTHOR["email"])
         except subprocess.CalledProcessError as e:
-            print(f"  ⚠️ Error updating branch {branch}: {e.stderr.decode() if e.stderr else str(e)}", file=sys.stderr)
-            return False
+            print(f"  ⚠️ Error cloning {repo_name}: {git_error(e, token)}", file=sys.stderr)
+            if mirror_path is not None:
+                mirror_cache.release(mirror_path)
+            return {branch: "failed" for branch in branches}
+        
+        remote_branches = set(
+            git(repo_dir, "for-each-ref", "--format=%(refname:strip=3)", "refs/remotes/origin").stdout.split()
+        )
+        
+        to_push = []
+        for branch in branches:
+            try:
+                # 切换到目标分支；如果分支不存在，从 main 创建
+                if branch in remote_branches:
+                    git(repo_dir, "checkout", "-q", "-f", "-B", branch, f"origin/{branch}")
+                elif "main" in remote_branches:
+                    git(repo_dir, "checkout", "-q", "-f", "-B", branch, "origin/main")
+                else:
+                    print(f"  ⚠️ Branch {branch} not found and no main branch to create it from", file=sys.stderr)
+                    results[branch] = "failed"
+                    continue
+                
+                if not apply_template_files(repo_dir, template_workflow_dir):
+                    results[branch] = "unchanged"
+                    continue
+                
+                # 添加文件
+                git(repo_dir, "add", "-A", ".gitea/workflows/", ".autograde/")
+                
+                # 检查是否有更改
+                if git(repo_dir, "diff", "--cached", "--quiet", check=False).returncode == 0:
+                    results[branch] = "unchanged"
+                    continue
+                
+                # 提交
+                git(repo_dir, "commit", "-m", f"Update workflow files from template (branch: {branch})")
+                to_push.append(branch)
+            except subprocess.CalledProcessError as e:
+                print(f"  ⚠️ Error updating branch {branch}: {git_error(e, token)}", file=sys.stderr)
+                results[branch] = "failed"
+        
+        if to_push:
+            # 一次推送所有有变更的分支
+            try:
+                if push_slots is not None:
+                    with push_slots:
+                        git(repo_dir, "push", remote_url, *[f"refs/heads/{b}:refs/heads/{b}" for b in to_push])
+                else:
+                    git(repo_dir, "push", remote_url, *[f"refs/heads/{b}:refs/heads/{b}" for b in to_push])
+                results.update({branch: "updated" for branch in to_push})
+            except subprocess.CalledProcessError as e:
+                print(f"  ⚠️ Error pushing {repo_name}: {git_error(e, token)}", file=sys.stderr)
+                results.update({branch: "failed" for branch in to_push})
+    
+    if mirror_path is not None:
+        mirror_cache.release(mirror_path)
+    return results
+
+
+def process_repo(client, gitea_url, token, org, repo_name, branches, template_workflow_dir, push_slots=None,
+                 method="git", template_files=None, manifest=None, mirror_cache=None):
+    """
+    处理单个仓库：获取分支列表（未指定时）并更新所有分支
+
+    method 为 "api" 时通过 contents API 提交（需提供 template_files 和 manifest），否则克隆后推送。
+    git 方式下提供 manifest 时，先用 trees API 跳过已是最新的分支，全部最新时不克隆。
+
+    返回结果 dict: repo, branches ({branch: status}), ok, elapsed
+    """
+    started = time.monotonic()
+    if not branches:
+        branches = get_branches(client, org, repo_name) or ["main"]  # 默认分支
+    
+    if method == "api":
+        results = update_workflows_via_api(client, org, repo_name, branches, template_files, manifest, push_slots)
+    else:
+        outdated = branches
+        if manifest is not None:
+            outdated = find_outdated_branches(client, org, repo_name, branches, manifest)
+        results = {branch: "unchanged" for branch in branches if branch not in outdated}
+        if outdated:
+            results.update(update_workflows_in_repo(
+                gitea_url, token, org, repo_name, outdated, template_workflow_dir, push_slots, mirror_cache
+            ))
+    branch_results = {branch: results.get(branch, "failed") for branch in branches}
+    return {
+        "repo": repo_name,
+        "branches": branch_results,
+        "ok": all(status != "failed" for status in branch_results.values()),
+        "elapsed": round(time.monotonic() - started, 2),
+    }
+
+
+def format_progress(done, total, started, width=30):
+    """生成进度条文本，例如 [######------] 12/30 40% ETA 1m05s"""
+    filled = int(width * done / total) if total else width
+    elapsed = time.monotonic() - started
+    remaining = int(elapsed / done * (total - done)) if done else 0
+    eta = f"{remaining // 60}m{remaining % 60:02d}s"
+    return f"[{'#' * filled}{'-' * (width - filled)}] {done}/{total} {done * 100 // max(total, 1)}% ETA {eta}"
+
+
+def read_failed_list(path):
+    """
+    读取失败列表文件，每行 "repo branch"
+
+    返回 {repo: [branch, ...]}，保持文件中的顺序
+    """
+    targets = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2:
+                targets.setdefault(parts[0], []).append(parts[1])
+    return targets
+
+
+def write_failed_list(path, results):
+    """将失败的仓库/分支写入文件，供 --retry-failed 使用"""
+    with open(path, "w", encoding="utf-8") as f:
+        for result in results:
+            for branch, status in result["branches"].items():
+                if status == "failed":
+                    f.write(f"{result['repo']} {branch}\n")
 
 
 def main():
@@ -238,7 +450,26 @@ def main():
     parser.add_argument("--gitea-url", default=os.getenv("GITEA_URL", "http://localhost:3000"))
     parser.add_argument("--token", default=os.getenv("GITEA_ADMIN_TOKEN", ""))
     parser.add_argument("--repo", help="Update specific repository only")
-    parser.add_argument("--branch", help="Update specific branch only (requires --repo)")
+    parser.add_argument("--branch", help="Update specific branch only (in --repo, or in every matched repository)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("ROLLOUT_WORKERS", "4")),
+                        help="Number of repositories updated concurrently (1 = serial)")
+    parser.add_argument("--max-pushes", type=int, default=int(os.getenv("ROLLOUT_MAX_PUSHES", "2")),
+                        help="Maximum number of simultaneous git pushes (or contents API commits with --method api)")
+    parser.add_argument("--method", choices=["git", "api"], default=os.getenv("ROLLOUT_METHOD", "git"),
+                        help="git: clone and push; api: commit changed files via the contents API without cloning")
+    parser.add_argument("--no-precheck", action="store_true",
+                        help="git method: clone every branch instead of skipping branches whose files already match")
+    parser.add_argument("--mirror-cache", action="store_true",
+                        help="git method: keep persistent bare mirrors of student repos and fetch only deltas")
+    parser.add_argument("--mirror-dir", help="Mirror cache directory (default: ~/.cache/gitea-autograde/mirrors)")
+    parser.add_argument("--mirror-max-size", type=int, default=int(os.getenv("MIRROR_CACHE_MAX_MB", "2048")),
+                        help="Evict least recently used mirrors when the cache exceeds this size in MB")
+    parser.add_argument("--refresh-index", action="store_true",
+                        help="Ignore the cached organization repository list and fetch it again")
+    parser.add_argument("--failed-list",
+                        help="File to record failed repo/branch pairs (default: update_failed_{assignment}.txt)")
+    parser.add_argument("--retry-failed", metavar="FILE",
+                        help="Only retry the repo/branch pairs listed in FILE (written by a previous run)")
     
     args = parser.parse_args()
     
@@ -269,41 +500,99 @@ def main():
         print(f"Error: Template workflow directory not found: {template_workflow_dir}", file=sys.stderr)
         sys.exit(1)
     
-    # 获取仓库列表
-    if args.repo:
-        repos = [args.repo]
+    workers = max(1, args.workers)
+    client = GiteaClient(args.gitea_url, args.token, pool_size=workers)
+    
+    # 获取仓库列表 -> {repo: branches}，branches 为 None 表示更新所有分支
+    if args.retry_failed:
+        targets = read_failed_list(args.retry_failed)
+        print(f"🔁 Retrying {sum(len(b) for b in targets.values())} failed branches "
+              f"in {len(targets)} repositories from {args.retry_failed}")
+    elif args.repo:
+        targets = {args.repo: [args.branch] if args.branch else None}
     else:
         print(f"🔍 Searching for repositories with prefix: {prefix}")
-        repos = get_repos(args.gitea_url, args.token, org, prefix)
-        print(f"Found {len(repos)} repositories")
+        targets = {
+            repo_name: [args.branch] if args.branch else None
+            for repo_name in get_repos(client, org, prefix, refresh=args.refresh_index)
+        }
+        print(f"Found {len(targets)} repositories")
     
-    success_count = 0
-    fail_count = 0
+    if not targets:
+        print("Nothing to update")
+        return
     
-    for repo_name in repos:
-        print(f"\n📦 Processing {repo_name}...")
-        
-        # 获取分支列表
-        if args.branch:
-            branches = [args.branch]
-        else:
-            branches = get_branches(args.gitea_url, args.token, org, repo_name)
-            if not branches:
-                branches = ["main"]  # 默认分支
-        
-        print(f"  Found {len(branches)} branches: {', '.join(branches)}")
-        
-        for branch in branches:
-            print(f"  📝 Updating branch: {branch}")
-            if update_workflow_in_branch(args.gitea_url, args.token, org, repo_name, branch, template_workflow_dir):
-                print(f"    ✅ Success")
-                success_count += 1
-            else:
-                print(f"    ❌ Failed")
-                fail_count += 1
+    push_slots = threading.Semaphore(max(1, args.max_pushes))
+    mirror_cache = None
+    if args.method == "git" and args.mirror_cache:
+        mirror_cache = MirrorCache(args.mirror_dir, max_bytes=args.mirror_max_size * 1024 * 1024)
+        print(f"Mirror cache: {mirror_cache.root}")
+    template_files = load_template_files(template_workflow_dir)
+    manifest = build_template_manifest(template_files)
+    print(f"📋 Template manifest: {len(manifest)} files")
+    if args.method == "git" and args.no_precheck:
+        manifest = None
+    if args.method == "api":
+        print(f"🚀 Updating {len(targets)} repositories with {workers} workers via the contents API "
+              f"(max {max(1, args.max_pushes)} concurrent commits)...")
+    else:
+        print(f"🚀 Updating {len(targets)} repositories with {workers} workers "
+              f"(max {max(1, args.max_pushes)} concurrent pushes)...")
     
-    print(f"\n📊 Summary: {success_count} succeeded, {fail_count} failed")
-
+    results = {}
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                process_repo,
+                client, args.gitea_url, args.token, org,
+                repo_name, branches, template_workflow_dir, push_slots,
+                args.method, template_files, manifest, mirror_cache
+            ): repo_name
+            for repo_name, branches in targets.items()
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            repo_name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"  ⚠️ Error processing {repo_name}: {e}", file=sys.stderr)
+                result = {"repo": repo_name, "branches": {b: "failed" for b in targets[repo_name] or ["main"]},
+                          "ok": False, "elapsed": 0}
+            results[repo_name] = result
+            
+            updated = sum(1 for status in result["branches"].values() if status == "updated")
+            failed = sum(1 for status in result["branches"].values() if status == "failed")
+            icon = "✅" if result["ok"] else "❌"
+            print(f"{format_progress(done, len(targets), started)}  {icon} {repo_name}: "
+                  f"{len(result['branches'])} branches, {updated} updated, {failed} failed ({result['elapsed']}s)")
+    
+    if mirror_cache is not None:
+        removed = mirror_cache.evict()
+        if removed:
+            print(f"🧹 Evicted {len(removed)} least recently used mirrors from the cache")
+    
+    ordered = [results[repo_name] for repo_name in targets]
+    success_count = sum(1 for r in ordered for status in r["branches"].values() if status != "failed")
+    fail_count = sum(1 for r in ordered for status in r["branches"].values() if status == "failed")
+    
+    failed_repos = [r for r in ordered if not r["ok"]]
+    if failed_repos:
+        print("\n❌ Failed:")
+        for r in failed_repos:
+            failed_branches = [b for b, status in r["branches"].items() if status == "failed"]
+            print(f"  {r['repo']}: {', '.join(failed_branches)}")
+    
+    failed_list = args.failed_list or f"update_failed_{args.assignment}.txt"
+    if failed_repos:
+        write_failed_list(failed_list, failed_repos)
+        print(f"\nFailed branches saved to {failed_list}")
+        print(f"Retry with: --retry-failed {failed_list}")
+    elif args.retry_failed and os.path.exists(failed_list):
+        os.remove(failed_list)
+    
+    print(f"\n📊 Summary: {success_count} succeeded, {fail_count} failed "
+          f"({time.monotonic() - started:.1f}s)")
 
 if __name__ == "__main__":
     main()